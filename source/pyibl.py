@@ -11,24 +11,35 @@ facilitating debugging, logging and fine grained control of complex models.
 
 __version__ = "4.2"
 
-PYACTUP_MINIMUM_VERSION = "1.1.2"
+PYACTUP_MINIMUM_VERSION = "1.1.4"
 
 if "dev" in __version__:
     print("PyIBL version", __version__)
 
+import atexit
 import collections.abc as abc
+import copy
 import csv
+import functools
 import io
+import json
+import logging
+import math
 import numbers
+import numpy as np
 import os
+import pickle
 import pyactup
+import queue
 import random
 import re
 import sys
+import threading
 import warnings
 
-from collections import namedtuple
-from itertools import count
+from collections import ChainMap, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, compress, count, islice, repeat
 from keyword import iskeyword
 from ordered_set import OrderedSet
 from packaging import version
@@ -60,6 +71,33 @@ class Agent:
     The agent properties :attr:`noise`, :attr:`decay`, :attr:`temperature`,
     :attr:`mismatch_penalty`, :attr:`optimized_learning` and :attr:`default_utility` can
     be initialized when creating an Agent.
+
+    If *vectorized* is true the agent stores its instances in NumPy arrays, and computes
+    the activations, retrieval probabilities and blended values for all the choices of a
+    call to :meth:`choose` together, with a small number of vectorized operations, rather
+    than one instance at a time. The results are the same, up to the vagaries of noise and
+    floating point rounding, as those of an agent that is not vectorized, but for agents
+    with many instances, or models run many times, they are typically computed much more
+    quickly. Whether or not an agent is vectorized can be ascertained from its
+    :attr:`vectorized` property, and cannot be changed after the agent is created.
+
+    Normally an agent draws the random numbers it needs, for activation noise and for
+    breaking ties between equally good choices, from the state shared by the whole
+    process, so that seeding Python's :mod:`random` module makes a model's results
+    reproducible. If *rng* is supplied and is not ``None`` the agent instead draws them
+    all from a random number generator of its own, which makes it reproducible
+    independently of any other agents in the process. The *rng* may be a NumPy
+    :class:`numpy.random.Generator`, a :class:`random.Random`, or an integer, which is
+    used to seed a fresh NumPy :class:`numpy.random.Generator`. Activation noise is
+    always drawn from a NumPy :class:`numpy.random.Generator`, in large blocks, so a
+    :class:`random.Random` is used only to break ties, and to seed such a generator. A
+    :exc:`ValueError` is raised if *rng* is not one of these.
+
+    If *template* is supplied it is a :class:`MemoryTemplate`, whose instances the agent
+    starts with, and starts with again whenever it is :meth:`reset`. The template must
+    have the same attributes as the agent, and must use optimized learning if and only if
+    the agent's :attr:`optimized_learning` is ``True``; otherwise a :exc:`ValueError` is
+    raised.
     """
 
     _agent_number = 0
@@ -72,25 +110,47 @@ class Agent:
                  temperature=None,
                  mismatch_penalty=None,
                  optimized_learning=False,
-                 default_utility=None):
+                 default_utility=None,
+                 vectorized=False,
+                 rng=None,
+                 template=None):
         self._attributes = Agent._ensure_attribute_names(list(attributes))
+        optimized_learning, exact_references = _split_optimized_learning(optimized_learning)
+        if template is not None:
+            if not isinstance(template, MemoryTemplate):
+                raise TypeError(f"{template} is not a MemoryTemplate")
+            if template.attributes != tuple(self._attributes):
+                raise ValueError(f"the template's attributes, {template.attributes}, are not the same as the agent's")
+            if template.optimized_learning != bool(optimized_learning):
+                raise ValueError("the template and the agent must either both or neither use optimized learning")
+        self._template = template
         if name is None:
             Agent._agent_number += 1
             name = f"agent-{Agent._agent_number}"
         elif not (isinstance(name, str) and len(name) > 0):
             raise TypeError(f"Agent name {name} is not a non-empty string")
         self._name = name
-        self._memory = pyactup.Memory(learning_time_increment=0,
-                                      optimized_learning=optimized_learning)
+        self._vectorized = bool(vectorized)
+        self._rng = Agent._rng_value(rng)
+        memory_class = _ArrayMemory if self._vectorized else _Memory
+        self._memory = memory_class(rng=self._rng,
+                                    learning_time_increment=0,
+                                    optimized_learning=optimized_learning)
+        self._memory._exact_references = exact_references
         self.temperature = temperature # set temperature BEFORE noise
         self.noise = noise
         self.decay = decay
         self.mismatch_penalty = mismatch_penalty
         self.default_utility = default_utility
         self.default_utility_populates = True
-        self._attribute_similarities = [None] * len(self._attributes)
         self._details = None
+        self._details_every = None
+        self._details_fraction = None
+        self._details_top = None
+        self._details_calls = 0
         self._trace = False
+        self._max_instances = None
+        self._approximate_blending = None
         self.reset()
         self._test_default_utility()
 
@@ -107,6 +167,14 @@ class Agent:
             result.add(a)
         return result
 
+    @staticmethod
+    def _rng_value(rng):
+        if isinstance(rng, numbers.Integral) and not isinstance(rng, bool):
+            return np.random.default_rng(rng)
+        if rng is None or isinstance(rng, (np.random.Generator, random.Random)):
+            return rng
+        raise ValueError(f"{rng} is neither a seed, a NumPy Generator nor a random.Random")
+
     def __repr__(self):
         return f"<Agent {str(self)} {id(self)}>"
 
@@ -140,15 +208,47 @@ class Agent:
         :attr:`defaultUtilityPopulates` is true are removed, but the settings of those
         properties are not altered.
 
-        If *optimized_learning* is supplied and is ``True`` or ``False`` it sets the
-        value of :attr:`optimized_learning` for this :class:`Agent`. If it is not supplied
-        or is ``None`` the current value of :attr:`optimized_learning` is not changed.
+        If *optimized_learning* is supplied and is ``True``, ``False`` or a positive
+        integer it sets the value of :attr:`optimized_learning` for this :class:`Agent`. If
+        it is not supplied or is ``None`` the current value of :attr:`optimized_learning`
+        is not changed.
+
+        If this agent was created with a :class:`MemoryTemplate` its memory is reset to
+        the instances of that template, to which, if *preserve_prepopulated* is true, are
+        added those instances the agent itself added at time zero. Attempting to change
+        whether or not such an agent's :attr:`optimized_learning` is ``True`` raises a
+        :exc:`ValueError`.
         """
-        self._memory.reset(preserve_prepopulated=preserve_prepopulated,
-                           optimized_learning=optimized_learning)
+        if self._template is None:
+            self._memory.reset(preserve_prepopulated=preserve_prepopulated,
+                               optimized_learning=optimized_learning)
+        else:
+            self._reset_to_template(preserve_prepopulated, optimized_learning)
         self._last_learn_time = 0
         self._previous_choices = None
         self._pending_decision = None
+        self._evicted = 0
+
+    def _reset_to_template(self, preserve_prepopulated, optimized_learning):
+        template = self._template
+        learning = _split_optimized_learning(optimized_learning)[0]
+        if learning is not None and bool(learning) != template.optimized_learning:
+            raise ValueError("optimized learning cannot be changed for an agent using a template")
+        preserved = []
+        if preserve_prepopulated:
+            # those instances the agent itself added at time zero, other than those that
+            # are simply instances of the template
+            keys = list(self._attributes) or ["_decision"]
+            queries, outcomes, created = self._memory.snapshot(keys)[:3]
+            preserved = [ (q, o) for q, o, t in zip(queries, outcomes, created.tolist())
+                          if t == 0 and (q, o) not in template._memory._signatures ]
+        self._memory.reset(optimized_learning=optimized_learning)
+        if self._vectorized:
+            self._memory.adopt(template._memory)
+        else:
+            self._memory.restore(*template._memory.snapshot(None))
+        for query, outcome in preserved:
+            self._memory.learn(_utility=outcome, **dict(query))
 
     @property
     def time(self):
@@ -201,7 +301,8 @@ class Agent:
         The default value is 0.5. If zero memory does not decay.
         If set to ``None`` it reverts the value to its default, 0.5.
         Attempting to set it to a negative number raises a :exc:`ValueError`.
-        It must be less one 1 if this agent's :attr:`optimized_learning` parameter is set.
+        It must be less one 1 if this agent's :attr:`optimized_learning` parameter is
+        ``True``.
         """
         return self._memory.decay
 
@@ -216,7 +317,8 @@ class Agent:
     def mismatch_penalty(self):
         """The mismatch penalty applied to partially matching values when computing activations.
         If ``None`` no partial matching is done.
-        Otherwise any defined similarity functions (see :func:`similarity`) are called as necessary, and
+        Otherwise any defined similarity functions (see :func:`similarity` and
+        :meth:`similarity`) are called as necessary, and
         the resulting values are multiplied by the mismatch penalty and subtracted
         from the activation. For any attributes and decisions for which similarity
         functions are not defined only instances matching exactly on these attributes or
@@ -234,12 +336,188 @@ class Agent:
         self._memory.mismatch = value
         self._test_default_utility()
 
+    @property
+    def retrieval_threshold(self):
+        """The activation an instance must reach to be included when blending, or ``None``, the default, if all matching instances are included.
+        This corresponds to the retrieval threshold, tau, of ACT-R. An instance whose
+        activation, including its activation noise and any mismatch penalty, is below the
+        threshold is disregarded when computing the blended value of a choice, as though
+        it had not been retrieved. If no instance matching a choice reaches the threshold
+        the choice is treated as though it had no matching instances, its blended value
+        being that given by :attr:`default_utility`.
+
+        A :attr:`vectorized` agent not using :attr:`optimized_learning` keeps an upper
+        bound on each instance's base level activation, computed from its number of
+        references and the time of the most recent of them, and does not compute the
+        base level activations of those instances that cannot reach the threshold even
+        with the noise they have been given. In memories dominated by old, rarely
+        referenced instances this avoids most of the work of activating them.
+
+        Attempting to set this parameter to a value other than ``None`` or a real number
+        raises a :exc:`ValueError`.
+        """
+        return self._memory._retrieval_threshold
+
+    @retrieval_threshold.setter
+    def retrieval_threshold(self, value):
+        if value is not None:
+            if not isinstance(value, numbers.Real) or isinstance(value, bool):
+                raise ValueError(f"retrieval_threshold, {value}, must be None or a real number")
+            value = float(value)
+        self._memory._retrieval_threshold = value
+
+    @property
+    def approximate_blending(self):
+        """The number of instances blended for each choice, or ``None``, the default, if all those matching it are blended.
+        If :attr:`approximate_blending` is a positive integer, *k*, the blended value of
+        each choice is computed from only the *k* matching instances with the highest
+        activations, including their noise and any mismatch penalties, and retrieval
+        probabilities are only reported for those instances. For agents with many
+        instances matching each choice, most of whose retrieval probabilities are
+        negligible, this approximation can make the time taken by :meth:`choose` both
+        shorter and more predictable, since a :attr:`vectorized` agent not using
+        :attr:`optimized_learning` uses bounds on the instances' base level activations,
+        computed from their numbers of references and times of creation and of their most
+        recent references, and only computes the exact activations of those instances
+        that might be among the *k* highest.
+
+        A bound on the error this introduces into each blended value, that is on the
+        absolute difference between it and the blended value of all the matching
+        instances, is available as the ``error`` of the details returned by
+        :meth:`choose2`. If there is a :attr:`retrieval_threshold` instances below it are
+        disregarded before the *k* with the highest activations are chosen.
+
+        Attempting to set this parameter to a value other than ``None`` or a positive
+        integer raises a :exc:`ValueError`.
+        """
+        return self._approximate_blending
+
+    @approximate_blending.setter
+    def approximate_blending(self, value):
+        if value is not None:
+            if (not isinstance(value, numbers.Integral) or isinstance(value, bool)
+                    or value < 1):
+                raise ValueError(f"approximate_blending, {value}, must be None or a positive integer")
+            value = int(value)
+        self._approximate_blending = value
+
+    def similarity(self, function, *attributes):
+        """Sets a function to compute the similarity of values of the given *attributes* for this :class:`Agent` only.
+        This is like the module level :func:`similarity`, and *function* is subject to
+        the same constraints, but rather than being shared by all the agents in the
+        process *function* is used only by this agent, in preference to any set with
+        :func:`similarity` for the same attributes. This allows agents differing in their
+        similarity functions to be run side by side in one process. If called with no
+        *attributes* the *function* is applied to this agent's choices, which only makes
+        sense if it has no attributes. If *attributes* contains names that are not those
+        of this agent's attributes a :exc:`ValueError` is raised.
+
+        If ``True`` is passed as the value of *function* the default similarity function
+        is used, which returns one if its two arguments are ``==`` and zero otherwise. If
+        ``None`` is passed this agent's own similarity functions for the specified
+        attributes are removed, and any set with :func:`similarity` apply again.
+
+        An agent's similarity functions are retained when it is :meth:`reset`.
+
+        >>> a = Agent(attributes=["size"], mismatch_penalty=1)
+        >>> a.similarity(positive_linear_similarity, "size")
+        """
+        if attributes:
+            for a in Agent._ensure_attribute_names(attributes):
+                if a not in self._attributes:
+                    raise ValueError(f"{a} is not an attribute of {self}")
+        elif self._attributes:
+            raise ValueError(f"{self} has attributes, so its choices cannot have a similarity function")
+        else:
+            attributes = ["_decision"]
+        self._memory.set_similarity_function(function or None, *attributes)
+
     @property
     def optimized_learning(self):
         """Whether or not this :class:"`Agent` uses the optimized_learning approximation when computing instance activations.
         This can only be changed for an :class:`Agent` by calling :meth:`reset`.
+
+        If it is ``True`` an instance's base level activation is approximated from only
+        the number of times it has been referenced and the time it was created, as if
+        those references were spread evenly since then, which is quick to compute but
+        loses the effect of when the most recent of them occurred. If it is instead a
+        positive integer, *k*, the hybrid approximation described by Petrov (2006) is used:
+        the contributions of the *k* most recent references to each instance are computed
+        exactly, and those of all its older references are approximated in the same way,
+        as if spread evenly between its creation and the least recent of those *k*
+        references. The cost of computing an activation then no longer grows with the number
+        of references, while the effects of recent ones are preserved; unlike when it is
+        ``True`` the :attr:`decay` need not be less than one. The times of all the
+        references are still recorded, so they still appear in :attr:`details`, traces and
+        the results of :meth:`instances`, and the activations are those of
+        :attr:`optimized_learning` ``False`` whenever no instance has been referenced more
+        than *k* times. A :exc:`ValueError` is raised by :meth:`reset` or when creating an
+        agent if *optimized_learning* is an integer less than one.
+
+        >>> a = Agent(optimized_learning=10)
+        >>> a.optimized_learning
+        10
+        >>> a.reset(optimized_learning=True)
+        >>> a.optimized_learning
+        True
         """
-        return self._memory.optimized_learning
+        return self._memory._exact_references or self._memory.optimized_learning
+
+    @property
+    def max_instances(self):
+        """The largest number of instances this :class:`Agent` keeps in its memory, or ``None``, the default, if there is no limit.
+        Unless limited, an agent's memory grows without bound, since every distinct
+        outcome of a choice adds a new instance. If :attr:`max_instances` is a positive
+        integer, whenever :meth:`respond`, :meth:`populate`, :meth:`populate_at` or
+        :meth:`DelayedResponse.update` leaves the agent with more instances than that,
+        those with the lowest base level activations are evicted, deleted from its memory,
+        until only nine tenths of :attr:`max_instances` remain, so that the cost of
+        choosing which to evict is not incurred at every call of :meth:`respond`. The
+        base level activations are those the instances would have at the next time, and
+        thus of the next call of :meth:`choose`, without noise or mismatch penalties; the
+        instances evicted are those whose retrieval probabilities are most likely to be
+        negligible. Instances added by a :attr:`default_utility` are added by
+        :meth:`choose`, and may briefly take the agent beyond :attr:`max_instances` until
+        the following call of :meth:`respond`.
+
+        Setting :attr:`max_instances` evicts instances immediately if there are already
+        more than it allows. Attempting to set it to anything other than ``None`` or a
+        positive integer raises a :exc:`ValueError`. The number of instances evicted
+        since the agent was created or last :meth:`reset` is available as :attr:`evicted`.
+        """
+        return self._max_instances
+
+    @max_instances.setter
+    def max_instances(self, value):
+        if value is not None:
+            if (not isinstance(value, numbers.Integral) or isinstance(value, bool)
+                    or value < 1):
+                raise ValueError(f"max_instances, {value}, must be None or a positive integer")
+            value = int(value)
+        self._max_instances = value
+        self._enforce_max_instances()
+
+    @property
+    def evicted(self):
+        """The number of instances evicted from this :class:`Agent`'s memory since it was created or last :meth:`reset`.
+        See :attr:`max_instances`.
+        """
+        return self._evicted
+
+    def _enforce_max_instances(self):
+        limit = self._max_instances
+        if limit is None:
+            return
+        excess = self._memory.instance_count() - limit
+        if excess > 0:
+            self._evicted += self._memory.evict(excess + limit // 10)
+
+    @property
+    def vectorized(self):
+        """Whether or not this :class:`Agent` stores its instances in NumPy arrays and blends them with vectorized operations.
+        This can only be set when the :class:`Agent` is created.
+        """
+        return self._vectorized
 
     @property
     def details(self):
@@ -255,8 +533,15 @@ class Agent:
             a lot of information quickly. It is often best to ``clear()`` or otherwise
             reset the ``details`` frequently.
 
+        It can also be set to a :class:`DetailsRecorder`, which records the same
+        information in NumPy arrays, much more quickly and compactly than as the
+        dictionaries described below, or to a :class:`DetailsWriter`, which streams the
+        dictionaries to a file or elsewhere, in a background thread, rather than
+        accumulating them in memory.
+
         A :exc:`ValueError` is raised if an attempt is made to set its value to anything
-        other than ``None``, ``True`` or a :class:`MutableSequence`.
+        other than ``None``, ``True``, a :class:`MutableSequence`, a
+        :class:`DetailsRecorder` or a :class:`DetailsWriter`.
 
         >>> a = Agent(default_utility=10)
         >>> a.choose("a", "b", "c")
@@ -313,15 +598,124 @@ class Agent:
             value = None
         elif value == True:
             value = []
-        if not (value is None or isinstance(value, abc.MutableSequence)):
-            raise ValueError("the value of details must be None or a list or other MutableSequence")
+        if not (value is None or isinstance(value, (abc.MutableSequence, DetailsRecorder,
+                                                    DetailsWriter))):
+            raise ValueError("the value of details must be None, a list or other MutableSequence, a DetailsRecorder or a DetailsWriter")
         self._details = value
 
+    def sample_details(self, every=None, fraction=None, top=None, seed=None):
+        """Restricts the :attr:`details` captured by this :class:`Agent` to a sample of them.
+        If *every* is a positive integer the details of only every *every*-th call to
+        :meth:`choose` are captured, starting with the first such call after
+        :meth:`sample_details` is called. If *fraction* is a real number between zero and
+        one the details of each call are captured with that probability. If both are
+        supplied a call's details are captured only if both would capture them. Whether
+        or not a call's details are to be captured is decided before any of its details
+        are computed, so calls whose details are not captured cost no more than they
+        would were :attr:`details` ``None``.
+
+        If *top* is a positive integer then, for each choice, only the details of the
+        *top* instances with the highest retrieval probabilities are captured, in the
+        order in which they would otherwise appear.
+
+        The random numbers used to sample with *fraction* are drawn from a generator of
+        their own, so that sampling does not change the choices made by the agent. It is
+        seeded with *seed*, if supplied, or otherwise from the random number generator
+        with which the agent was created, if any, or from Python's :mod:`random` module,
+        without drawing any numbers from them: a NumPy Generator's seed sequence spawns a
+        child for it, while the current state of a :class:`random.Random` is used as its
+        entropy.
+
+        Calling :meth:`sample_details` with no arguments restores the capture of all
+        details. The sampling is not affected by :meth:`reset`, nor by changing the value
+        of :attr:`details`, and does not apply to :attr:`trace` or to the retrieval
+        probabilities returned by :meth:`choose2`. A :exc:`ValueError` is raised if
+        *every* or *top* is neither ``None`` nor a positive integer, or if *fraction* is
+        neither ``None`` nor a real number between zero and one.
+
+        >>> a = Agent(default_utility=10)
+        >>> a.details = True
+        >>> a.sample_details(every=10, top=1)
+        >>> for i in range(100):
+        ...     a.choose("a", "b", "c")
+        ...     a.respond(i % 3)
+        ...
+        >>> len(a.details)
+        10
+        """
+        for name, value in (("every", every), ("top", top)):
+            if not (value is None or (isinstance(value, numbers.Integral)
+                                      and not isinstance(value, bool) and value > 0)):
+                raise ValueError(f"{name}, {value}, must be None or a positive integer")
+        if not (fraction is None or (isinstance(fraction, numbers.Real) and 0 <= fraction <= 1)):
+            raise ValueError(f"fraction, {fraction}, must be None or a real number between zero and one")
+        self._details_every = every
+        self._details_fraction = fraction
+        self._details_top = top
+        self._details_calls = 0
+        if fraction is not None:
+            self._details_sampler = np.random.default_rng(self._sampler_seed()
+                                                          if seed is None else seed)
+
+    def _sampler_seed(self):
+        # Returns a seed for the generator used by sample_details(), derived from this
+        # agent's random number generator, or the random module's, without drawing from
+        # it, so that the noise and tie breaking of the agent are unchanged. A Generator
+        # whose bit generator was not seeded from a SeedSequence, as for a legacy seed,
+        # has nothing to spawn from, and None, for fresh entropy from the OS, is returned.
+        if isinstance(self._rng, np.random.Generator):
+            bits = self._rng.bit_generator
+            # seed_seq is only public from NumPy 1.25
+            sequence = getattr(bits, "seed_seq", getattr(bits, "_seed_seq", None))
+            if isinstance(sequence, np.random.SeedSequence):
+                return sequence.spawn(1)[0]
+            return None
+        return np.random.SeedSequence(list((self._rng or random).getstate()[1]))
+
+    def _capture_details(self):
+        # Decides whether or not the details of the current call to choose() are to be
+        # captured, before any of them are computed.
+        if self._details is None:
+            return False
+        result = True
+        if self._details_every is not None:
+            result = self._details_calls % self._details_every == 0
+            self._details_calls += 1
+        if self._details_fraction is not None:
+            result = self._details_sampler.random() < self._details_fraction and result
+        return result
+
+    @staticmethod
+    def _top_history(history, k):
+        # Returns only those elements of history, a list of dicts or a dict of arrays as
+        # for a DetailsRecorder, with the k highest retrieval probabilities, in the same
+        # order as they appear in history.
+        if isinstance(history, dict):
+            probabilities = history["retrieval_probability"]
+            if len(probabilities) <= k:
+                return history
+            keep = np.sort(np.argpartition(-probabilities, k - 1)[:k])
+            return { key: (value if value is None
+                           else [ value[i] for i in keep ] if isinstance(value, list)
+                           else value[keep])
+                     for key, value in history.items() }
+        if not history or len(history) <= k:
+            return history
+        keep = sorted(sorted(range(len(history)),
+                             key=lambda i: history[i]["retrieval_probability"],
+                             reverse=True)[:k])
+        return [ history[i] for i in keep ]
+
     @property
     def trace(self):
         """A boolean which, if ``True``, causes the :class:`Agent` to print details of its computations to standard output.
         Intended for use as a tool for debugging models. By default it is ``False``.
 
+        It can also be set to a :class:`TraceWriter`, in which case the trace is
+        formatted in a background thread and written to a file or logger, or passed to a
+        function, instead of printed, optionally in a compact format more easily read by
+        programs.
+
         The output is divided into the blocks, the first line of which describes the
         choice being described and the blended value of its outcome. This is followed by
         a tabular description of various intermediate values used to arrive at this
@@ -375,7 +769,7 @@ class Agent:
 
     @trace.setter
     def trace(self, value):
-        self._trace = bool(value)
+        self._trace = value if isinstance(value, TraceWriter) else bool(value)
 
     @property
     def default_utility(self):
@@ -477,6 +871,10 @@ class Agent:
         Raises a :exc:`ValueError` if *outcome* is not a :class:`Real` number, or if any
         of the *choices* are malformed or duplicates.
         """
+        self._populate(outcome, choices)
+        self._enforce_max_instances()
+
+    def _populate(self, outcome, choices):
         Agent._outcome_value(outcome)
         for choice in self._make_queries(choices):
             self._memory.learn(_utility=outcome, **choice)
@@ -549,7 +947,8 @@ class Agent:
         malformed or duplicates.
 
         """
-        self._at_time(when, lambda: self.populate(outcome, *choices))
+        self._at_time(when, lambda: self._populate(outcome, choices))
+        self._enforce_max_instances()
 
     def choose(self, *choices):
         """Selects which of the *choices* is expected to result in the largest payoff, and returns it.
@@ -635,9 +1034,13 @@ class Agent:
         behaves just like :meth:`choose`.
 
         The second return value is a list of named tuples, one for each choice. These
-        named tuples have slots for the choice, the blended value, and list of
-        retrieval probability descriptions. The slots can be accessed either by index,
-        or by the names ``.choice``, ``.blended_value`` and ``retrieval_probabilities``.
+        named tuples have slots for the choice, the blended value, a list of
+        retrieval probability descriptions, and a bound on the error of the blended
+        value. The slots can be accessed either by index, or by the names ``.choice``,
+        ``.blended_value``, ``retrieval_probabilities`` and ``.error``. The error is
+        ``None`` unless the agent is using :attr:`approximate_blending`, in which case it
+        is a bound on the absolute difference between the blended value and that which
+        would have been computed had all the retrieved instances been blended.
 
         The retrieval probability descriptions are themselves named tuples, one for each
         instance consulted in constructing the given choice's blended value. Each of these
@@ -659,9 +1062,11 @@ class Agent:
         >>> data
         [BlendingDetails(choice='Tilset', blended_value=4.167913364924516,
                          retrieval_probabilities=[RetrievalProbability(utility=10, retrieval_probability=0.3519903738805018),
-                                                  RetrievalProbability(utility=1, retrieval_probability=0.6480096261194982)]),
+                                                  RetrievalProbability(utility=1, retrieval_probability=0.6480096261194982)],
+                         error=None),
          BlendingDetails(choice='Wensleydale', blended_value=10.0,
-                         retrieval_probabilities=[RetrievalProbability(utility=10, retrieval_probability=1.0)])]
+                         retrieval_probabilities=[RetrievalProbability(utility=10, retrieval_probability=1.0)],
+                         error=None)]
         >>> data[0].choice
         'Tilset'
         >>> data[0].blended_value
@@ -683,7 +1088,9 @@ class Agent:
                                       ["utility", "retrieval_probability"])
 
     BlendingDetails = namedtuple("BlendingDetails",
-                                 ["choice", "blended_value", "retrieval_probabilities"])
+                                 ["choice", "blended_value", "retrieval_probabilities",
+                                  "error"],
+                                 defaults=[None])
 
     def _choose(self, choices, include_retrieval_probabilities):
         if self._pending_decision:
@@ -696,20 +1103,31 @@ class Agent:
                 raise ValueError("no choices were supplied and no default ones are available")
         queries = self._make_queries(choices)
         self._previous_choices = choices
-        details = [] if self._details is not None else None
+        capture = self._capture_details()
+        recorder = (self._details if capture and isinstance(self._details, DetailsRecorder)
+                    else None)
+        details = [] if capture and recorder is None else None
+        top = self._details_top
+        want_history = include_retrieval_probabilities or capture or self._trace
+        if recorder is not None and not (include_retrieval_probabilities or self._trace):
+            want_history = "columns"
+        histories = []
+        traces = []
+        utilities = []
+        ret_probs = []
+        errors = []
         try:
-            if include_retrieval_probabilities or details is not None or self._trace:
-                history = []
-                self._memory.activation_history = history
-            else:
-                history = None
             if self._last_learn_time >= self._memory.time:
                 self._memory.advance(self._last_learn_time - self._memory.time + 1)
-            utilities = []
-            ret_probs = []
             with self._memory.fixed_noise:
-                for c, q in zip(choices, queries):
-                    u = self._memory.blend("_utility", **q)
+                for c, q, (u, history, error) in zip(
+                        choices, queries,
+                        self._blend(queries, want_history, self._prune_value(want_history))):
+                    if u is _DOMINATED:
+                        # skipped, and thus not chosen, nor having any details
+                        utilities.append(None)
+                        errors.append(None)
+                        continue
                     if u is None:
                         if self._default_utility:
                             if self._callable_default_utility:
@@ -721,79 +1139,179 @@ class Agent:
                         else:
                             raise RuntimeError(f"No experience available for choice {c}")
                     utilities.append(u)
+                    errors.append(error)
+                    if recorder is not None:
+                        histories.append(history if top is None
+                                         else Agent._top_history(history, top))
                     if include_retrieval_probabilities:
                         ret_probs.append([Agent.RetrievalProbability(Agent._extract_instance_utility(inst),
                                                                      inst["retrieval_probability"])
-                                          for inst in self._memory.activation_history])
+                                          for inst in history])
                     if details is not None:
                         d = dict(q) if self.attributes else {"decision": q["_decision"]}
-                        d["activations"] = history
+                        d["activations"] = (history if top is None
+                                            else Agent._top_history(history, top))
                         d["blended"] = u
                         details.append(d)
-                    if history is not None:
-                        if self._trace:
-                            self._print_trace(q, u, history)
-                        history = []
-                        self._memory.activation_history = history
+                    if self._trace:
+                        traces.append((q, u, history))
         finally:
             self._memory.activation_history = None
-        if self._details is not None:
+        if recorder is not None:
+            recorder._record(self, queries, utilities, histories)
+        elif details is not None:
             self._details.append(details)
         if self._trace:
-            print(f"\n   {'='*140}")
-        best_indecies = [0]
-        best_utility = utilities[0]
-        for u, i in zip(utilities[1:], count(1)):
-            if u > best_utility:
+            self._write_trace(traces)
+        best_indecies = []
+        best_utility = None
+        for u, i in zip(utilities, count()):
+            if u is None:
+                continue
+            if best_utility is None or u > best_utility:
                 best_utility = u
                 best_indecies = [i]
             elif u == best_utility:
                 best_indecies.append(i)
-        best = random.choice(best_indecies)
+        if self._rng is None:
+            best = random.choice(best_indecies)
+        elif isinstance(self._rng, random.Random):
+            best = self._rng.choice(best_indecies)
+        else:
+            best = best_indecies[self._rng.integers(len(best_indecies))]
         self._pending_decision = (best, choices, queries, utilities)
         if include_retrieval_probabilities:
-            return choices[best], list(map(Agent.BlendingDetails, choices, utilities, ret_probs))
+            return choices[best], list(map(Agent.BlendingDetails,
+                                           choices, utilities, ret_probs, errors))
         else:
             return choices[best]
 
+    def _blend(self, queries, want_history, prune=None):
+        # Yields a triple for each of the queries, the blended value, or None if there
+        # are no matching instances, if want_history is true, the activation history for
+        # that blending operation, and, if blending approximately, a bound on the error of
+        # the blended value, otherwise None. If want_history is "columns" a vectorized
+        # memory supplies the history as a dict of arrays, for a DetailsRecorder. If prune
+        # is not None queries that cannot have the greatest blended value are skipped, as
+        # described for _ArrayMemory.blend_all(), _DOMINATED being yielded for them.
+        top = self._approximate_blending
+        if self._vectorized:
+            yield from self._memory.blend_all(queries, want_history, top, prune)
+            return
+        if prune is not None and len(queries) > 2:
+            # with only two choices at most one blend could be skipped, saving about as
+            # much as the pass over memory finding their chunks costs
+            yield from self._blend_pruned(queries, top, prune)
+            return
+        for q in queries:
+            history = [] if want_history else None
+            self._memory.activation_history = history
+            if top is None:
+                yield self._memory.blend("_utility", **q), history, None
+            else:
+                value, error = self._memory.blend_top(top, **q)
+                yield value, history, error
+
+    def _blend_pruned(self, queries, top, prune):
+        # As for _ArrayMemory._blend_pruned(), for an agent that is not vectorized. The
+        # chunks matching all the queries are found in a single pass over memory, and
+        # each query is then blended over only its own.
+        memory = self._memory
+        matches = memory.match_all(queries)
+        greatest_outcomes = [ max(c["_utility"] for c in chunks) if chunks else math.inf
+                              for chunks in matches ]
+        order = sorted(range(len(queries)), key=lambda j: -greatest_outcomes[j])
+        results = [None] * len(queries)
+        greatest = None
+        for j in order:
+            if not matches[j]:
+                results[j] = (None, None, None)
+                continue
+            if greatest is not None and max(greatest_outcomes[j], prune) < greatest:
+                results[j] = (_DOMINATED, None, None)
+                continue
+            memory._candidates = matches[j]
+            try:
+                if top is None:
+                    value, error = memory.blend("_utility", **queries[j]), None
+                else:
+                    value, error = memory.blend_top(top, **queries[j])
+            finally:
+                memory._candidates = None
+            results[j] = (value, None, error)
+            if value is not None and (greatest is None or value > greatest):
+                greatest = value
+        yield from results
+
+    def _prune_value(self, want_history):
+        # Returns the value to be passed as prune to _blend(), or None if choices are not
+        # to be skipped, as they are not when the details of all of them are wanted, when
+        # partially matching, as an instance may then match several choices, or when a
+        # choice might be given a default utility that is not known in advance, or that
+        # would be added to memory.
+        if want_history or self._memory.mismatch is not None:
+            return None
+        if self._memory._retrieval_threshold is None:
+            return -math.inf
+        if (self._default_utility and not self._callable_default_utility
+                and not self._default_utility_populates):
+            return self._default_utility
+        return None
+
     def _extract_instance_utility(inst):
         first_attr = inst["attributes"][0]
         assert first_attr[0] == "_utility"
         return first_attr[1]
 
-    def _print_trace(self, query, utility, history):
-        print()
-        if self.attributes:
-            print(", ".join(list(f"{k}: {v}" for k, v in query.items())), end="")
+    _TRACE_SEPARATOR = f"\n   {'='*140}"
+
+    def _write_trace(self, traces):
+        # Writes the traces, a list of a query, its blended value and its activation
+        # history for each choice of a call to choose(), to the trace's destination.
+        if isinstance(self._trace, TraceWriter):
+            self._trace.append((self._name, self.time, self.attributes,
+                                bool(self._memory.mismatch), self._memory.optimized_learning,
+                                traces))
+            return
+        for t in traces:
+            print(Agent._trace_table(self.attributes, self._memory.mismatch,
+                                     self._memory.optimized_learning, *t),
+                  end="", flush=True)
+        print(Agent._TRACE_SEPARATOR)
+
+    @staticmethod
+    def _trace_table(attributes, mismatch, optimized_learning, query, utility, history):
+        # Returns the text describing the blending of a single choice in a trace.
+        if attributes:
+            heading = ", ".join(list(f"{k}: {v}" for k, v in query.items()))
         else:
-            print(query["_decision"], end="")
-        print(f" → {utility}")
+            heading = query["_decision"]
         tab = PrettyTable()
-        fields = (["id"] + (list(self.attributes) or ["decision"]) +
+        fields = (["id"] + (list(attributes) or ["decision"]) +
                   ["created", "occurrences", "outcome", "base activation", "activation noise"])
-        if self._memory.mismatch:
+        if mismatch:
             fields.append("mismatch adjustment")
         fields.extend(["total activation", "retrieval probability"])
         tab.field_names = fields
         for h in history:
             attrs = dict(h["attributes"])
             row = [h["name"]]
-            if self.attributes:
-                for a in self.attributes:
+            if attributes:
+                for a in attributes:
                     row.append(attrs.get(a, ""))
             else:
                 row.append(attrs["_decision"])
             row.append(h["creation_time"])
-            row.append(h["references"] if self._memory.optimized_learning else list(h["references"]))
+            row.append(h["references"] if optimized_learning else list(h["references"]))
             row.append(attrs["_utility"])
             row.append(h["base_activation"])
             row.append(h["activation_noise"])
-            if self._memory.mismatch:
+            if mismatch:
                 row.append(h["mismatch"])
             row.append(h["activation"])
             row.append(h["retrieval_probability"])
             tab.add_row(row)
-        print(tab, flush=True)
+        return f"\n{heading} → {utility}\n{tab}\n"
 
     def respond(self, outcome=None, choice=None):
         """Provide the *outcome* resulting from the most recent decision selected by :meth:`choose` (or :meth:`choose2`)
@@ -842,14 +1360,24 @@ class Agent:
             self._memory.learn(_utility=Agent._outcome_value(outcome), **(queries[i]))
             self._last_learn_time = self._memory.time
             self._pending_decision = None
+            self._enforce_max_instances()
         else:
-            self._memory.learn(_utility=utilities[i], **(queries[i]))
+            expectation = utilities[i]
+            if expectation is None:
+                # the choice was not blended by choose() as it could not be chosen
+                expectation = next(self._blend([queries[i]], False))[0]
+                if expectation is None:
+                    expectation = (self._default_utility(choices[i])
+                                   if self._callable_default_utility
+                                   else self._default_utility)
+            self._memory.learn(_utility=expectation, **(queries[i]))
             self._last_learn_time = self._memory.time
-            result = DelayedResponse(self, queries[i], utilities[i])
+            result = DelayedResponse(self, queries[i], expectation)
             self._pending_decision = None
+            self._enforce_max_instances()
             return result
 
-    def instances(self, file=sys.stdout, pretty=True):
+    def instances(self, file=sys.stdout, pretty=True, format=None, chunk_size=65536):
         """Prints or returns all the instances currently stored in this :class:`Agent`.
         If *file* is ``None`` a list of dictionaries is returned, each corresponding
         to an instance. If *file* is a string it is taken as a file name, which is opened
@@ -860,40 +1388,366 @@ class Agent:
         When printing to a file if *pretty* is true, the default, a format intended for
         reading by humans is used. Otherwise comma separated values (CSV) format, more
         suitable for importing into spreadsheets, numpy, and the like, is used.
+
+        For agents with many instances the *format* may be used to avoid building a
+        dictionary for each of them. If it is ``"array"`` a NumPy structured array is
+        returned, and if it is ``"dataframe"`` a :class:`pandas.DataFrame`, in either
+        case with a column for each of the keys of the dictionaries, and *file* and
+        *pretty* are ignored. If it is ``"csv"`` the instances are written to *file* in
+        CSV format, as they are when *pretty* is false, and if it is ``"parquet"`` they
+        are written to *file*, which must be a file name or an open binary file, in Apache
+        Parquet format. Writing CSV or Parquet files, the instances are gathered and
+        written *chunk_size* at a time, so that little memory is needed however many
+        there are. Returning a DataFrame requires the :mod:`pandas` package, and writing
+        Parquet the :mod:`pyarrow` package, neither of which is otherwise needed by
+        PyIBL; if the one needed is not installed an :exc:`ImportError` is raised. A
+        :exc:`ValueError` is raised if *format* is not ``None`` or one of these values, or
+        if *chunk_size* is not a positive integer.
+
+        >>> a = Agent(attributes=["button", "size"])
+        >>> a.populate(10, {"button": "x", "size": 1}, {"button": "y", "size": 2})
+        >>> a.instances(format="array")
+        array([('x', 1, 10, 0, list([0])), ('y', 2, 10, 0, list([0]))],
+              dtype=[('button', '<U1'), ('size', '<i8'), ('outcome', '<i8'), ('created', '<i8'), ('occurrences', 'O')])
         """
+        if format not in Agent._INSTANCE_FORMATS:
+            raise ValueError(f"format, {format}, must be one of {', '.join(map(str, Agent._INSTANCE_FORMATS))}")
+        if not (isinstance(chunk_size, numbers.Integral) and chunk_size > 0):
+            raise ValueError(f"chunk_size, {chunk_size}, must be a positive integer")
+        chunks = self._instance_chunks(chunk_size)
+        if format == "array":
+            return Agent._instance_array(chunks)
+        if format == "dataframe":
+            import pandas
+            return pandas.DataFrame(Agent._joined_columns(chunks))
+        if format == "parquet":
+            Agent._write_parquet(chunks, file)
+            return
+        if format is None and (file is None or pretty):
+            result = [ dict(zip(columns.keys(), values))
+                       for columns in chunks
+                       for values in zip(*(v.tolist() if isinstance(v, np.ndarray) else v
+                                           for v in columns.values())) ]
+            if file is None:
+                return result
+            chunks = [ result ]
+            if not result:
+                return
+        if isinstance(file, io.TextIOBase):
+            Agent._print_instance_data(chunks, format is None and pretty, file)
+        else:
+            with open(file, "w+", newline=(None if format is None and pretty else "")) as f:
+                Agent._print_instance_data(chunks, format is None and pretty, f)
+
+    _INSTANCE_FORMATS = (None, "array", "dataframe", "csv", "parquet")
+
+    def _instance_chunks(self, chunk_size):
+        # Yields, for successive chunks of at most chunk_size of the instances, in the
+        # order in which they were created, a dict mapping the column names used by
+        # instances() to sequences of the values of those instances.
         attrs = [ (a, a) for a in self.attributes ]
         if not attrs:
             attrs = [ ("decision", "_decision") ]
-        result = []
-        for c in self._memory.values():
-            d = {name: c[a] for name, a in attrs}
-            d["outcome"] = c["_utility"]
-            d["created"] = c._creation
-            d["occurrences"] = c._references
-            result.append(d)
-        if file is None:
-            return result
-        if isinstance(file, io.TextIOBase):
-            Agent._print_instance_data(result, pretty, file)
-        else:
-            with open(file, "w+", newline=(None if pretty else "")) as f:
-                Agent._print_instance_data(result, pretty, f)
+        for columns in self._memory.instance_columns([ a for name, a in attrs ], chunk_size):
+            result = { name: columns[a] for name, a in attrs }
+            result["outcome"] = columns["_utility"]
+            result["created"] = columns["created"]
+            result["occurrences"] = columns["occurrences"]
+            yield result
 
     @staticmethod
-    def _print_instance_data(data, pretty, file):
-        if not data:
-            return
+    def _joined_columns(chunks):
+        result = {}
+        for columns in chunks:
+            for name, values in columns.items():
+                result.setdefault(name, []).extend(values)
+        return result
+
+    @staticmethod
+    def _instance_array(chunks):
+        columns = { name: Agent._column_array(values)
+                    for name, values in Agent._joined_columns(chunks).items() }
+        if not columns:
+            return np.empty(0)
+        result = np.empty(len(next(iter(columns.values()))),
+                          dtype=[ (name, values.dtype) for name, values in columns.items() ])
+        for name, values in columns.items():
+            result[name] = values
+        return result
+
+    @staticmethod
+    def _column_array(values):
+        # Returns a NumPy array of values, of numbers or strings if they all are, and
+        # otherwise of Python objects, which are not unpacked if they are sequences.
+        if isinstance(values, np.ndarray):
+            return values
+        if all(isinstance(v, numbers.Number) for v in values):
+            return np.array(values)
+        if all(isinstance(v, str) for v in values):
+            return np.array(values, dtype=str)
+        return np.fromiter(values, dtype=object, count=len(values))
+
+    @staticmethod
+    def _write_parquet(chunks, file):
+        import pyarrow
+        import pyarrow.parquet
+        writer = None
+        try:
+            for columns in chunks:
+                table = pyarrow.table({ name: (values if isinstance(values, np.ndarray)
+                                               else list(values))
+                                        for name, values in columns.items() })
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(file, table.schema)
+                else:
+                    table = table.cast(writer.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    @staticmethod
+    def _print_instance_data(chunks, pretty, file):
+        # Prints the instances in chunks, each either a list of dicts or a dict of columns,
+        # as by _instance_chunks(), in the latter case one at a time.
         if pretty:
+            data = chunks[0]
             tab = PrettyTable()
             tab.field_names = data[0].keys()
             for d in data:
                 tab.add_row(d.values())
             print(tab, file=file, flush=True)
+            return
+        w = csv.writer(file)
+        header = True
+        for columns in chunks:
+            if header:
+                w.writerow(columns.keys())
+                header = False
+            w.writerows(zip(*columns.values()))
+
+
+    def fork(self, name=None, rng=None):
+        """Returns a new :class:`Agent` in the same state as this one, which can then learn independently of it.
+        The new agent has the same attributes, parameters, default utility settings, time,
+        instances, similarity functions and pending decision, if any, as this one, but
+        subsequent calls to :meth:`choose` and :meth:`respond` of either affect only that
+        agent. This is intended for "look ahead," running hypothetical future trials from
+        the current state of an agent.
+
+        If this agent is :attr:`vectorized` forking is cheap: the new agent initially
+        shares this one's instances, and neither copies them until it first changes
+        them, and even then copies the record of the references to an instance only when
+        that instance is itself reinforced. Otherwise the new agent is given a complete
+        copy of this one's memory.
+
+        The new agent is named *name*, or, if that is not supplied, given a name as is an
+        agent created without one. If *rng* is supplied it is used as the new agent's
+        random number generator, as described for :class:`Agent`. Otherwise, if this agent
+        has a NumPy :class:`numpy.random.Generator` the new agent is given an independent
+        generator spawned from it, if a :class:`random.Random`, one seeded from it, and if
+        neither, the new agent, too, draws its random numbers from Python's :mod:`random`
+        module. The new agent does not share this agent's :attr:`details` or
+        :attr:`trace`.
+
+        >>> a = Agent(default_utility=10, vectorized=True)
+        >>> for i in range(100):
+        ...     choice = a.choose("safe", "risky")
+        ...     a.respond(3 if choice == "safe" else random.choice([0, 10]))
+        ...
+        >>> look_ahead = a.fork()
+        >>> for i in range(20):
+        ...     choice = look_ahead.choose("safe", "risky")
+        ...     look_ahead.respond(0)
+        ...
+        >>> a.time, look_ahead.time
+        (100, 120)
+        """
+        if rng is None:
+            if isinstance(self._rng, np.random.Generator):
+                seed_seq = getattr(self._rng.bit_generator, "seed_seq", None)
+                if seed_seq is not None:
+                    rng = np.random.default_rng(seed_seq.spawn(1)[0])
+                else:
+                    rng = np.random.default_rng(self._rng.integers(2**63))
+            elif isinstance(self._rng, random.Random):
+                rng = random.Random(self._rng.getrandbits(64))
+        result = copy.copy(self)
+        if name is None:
+            Agent._agent_number += 1
+            name = f"agent-{Agent._agent_number}"
+        elif not (isinstance(name, str) and len(name) > 0):
+            raise TypeError(f"Agent name {name} is not a non-empty string")
+        result._name = name
+        result._rng = Agent._rng_value(rng)
+        result._memory = self._memory.fork(result._rng)
+        result._details = None
+        result._trace = False
+        if hasattr(self, "_details_sampler"):
+            result._details_sampler = copy.deepcopy(self._details_sampler)
+        return result
+
+    _SAVE_FORMAT = "pyibl-agent"
+    _SAVE_VERSION = 1
+
+    def save(self, file):
+        """Saves the state of this :class:`Agent` to *file*, from which it can be restored with :meth:`load`.
+        The *file* may be a file name or an open, writable binary file. The state saved
+        includes the agent's name, attributes and parameters, its default utility
+        settings, its time, its instances and their references, any decision awaiting a
+        call to :meth:`respond`, its random number generator, its own similarity
+        functions, its :attr:`max_instances`, :attr:`retrieval_threshold` and
+        :attr:`approximate_blending`. It does not include its :attr:`details` or
+        :attr:`trace`, nor any :class:`DelayedResponse` objects, which cannot be updated
+        once the agent has been restored. Nor does it include any :class:`MemoryTemplate`
+        with which the agent was created, whose instances are saved as though they were
+        the agent's own.
+
+        The file is a NumPy ``.npz`` archive in which the instances are stored as a few
+        arrays, so that saving and restoring agents with many instances is fast. The
+        remaining, small, part of the state is stored with :mod:`pickle`, so a callable
+        :attr:`default_utility`, similarity functions set with :meth:`similarity`, and the
+        choices of a pending decision must be picklable. As with pickles, agents should
+        only be loaded from files that are trusted.
+
+        >>> a = Agent(default_utility=10)
+        >>> a.choose("a", "b")
+        'b'
+        >>> a.respond(5)
+        >>> a.save("agent.npz")
+        >>> b = Agent.load("agent.npz")
+        >>> b.instances()
+        +----------+---------+---------+-------------+
+        | decision | outcome | created | occurrences |
+        +----------+---------+---------+-------------+
+        |    a     |    10   |    0    |     [0]     |
+        |    b     |    10   |    0    |     [0]     |
+        |    b     |    5    |    1    |     [1]     |
+        +----------+---------+---------+-------------+
+        """
+        keys = list(self._attributes) or ["_decision"]
+        queries, outcomes, created, counts, references = self._memory.snapshot(keys)
+        memory = self._memory
+        pool = memory._noise_pool
+        header = {"format": Agent._SAVE_FORMAT,
+                  "version": Agent._SAVE_VERSION,
+                  "pyibl_version": __version__,
+                  "name": self._name,
+                  "attributes": list(self._attributes),
+                  "vectorized": self._vectorized,
+                  "noise": memory._noise,
+                  "decay": memory._decay,
+                  "temperature": memory._temperature_param,
+                  "mismatch_penalty": memory._mismatch,
+                  "optimized_learning": self.optimized_learning,
+                  "default_utility": self._default_utility,
+                  "default_utility_populates": self._default_utility_populates,
+                  "time": memory._time,
+                  "last_learn_time": self._last_learn_time,
+                  "previous_choices": self._previous_choices,
+                  "pending_decision": self._pending_decision,
+                  "rng": self._rng,
+                  "similarity_functions": memory._own_similarity_functions,
+                  "sample_details": (self._details_every, self._details_fraction,
+                                     self._details_top, self._details_calls,
+                                     getattr(self, "_details_sampler", None)),
+                  "noise_rng": pool._rng,
+                  "noise_next": pool._next,
+                  "max_instances": self._max_instances,
+                  "retrieval_threshold": memory._retrieval_threshold,
+                  "approximate_blending": self._approximate_blending,
+                  "evicted": self._evicted}
+        arrays = {"header": np.frombuffer(pickle.dumps(header), dtype=np.uint8),
+                  "outcomes": Agent._saved_column(outcomes),
+                  "created": created,
+                  "counts": counts,
+                  "references": references,
+                  "noise_block": pool._block}
+        for position, key in enumerate(keys):
+            arrays[f"queries.{key}"] = Agent._saved_column([ q[position][1] for q in queries ])
+        if isinstance(file, (str, os.PathLike)):
+            # np.savez() would append .npz to a file name lacking it
+            with open(file, "wb") as f:
+                np.savez(f, **arrays)
         else:
-            w = csv.DictWriter(file, data[0].keys())
-            w.writeheader()
-            for d in data:
-                w.writerow(d)
+            np.savez(file, **arrays)
+
+    @staticmethod
+    def _saved_column(values):
+        # Returns an array of values as for _column_array(), except that, so that they are
+        # restored as they were, it is of Python objects if they are of more than one
+        # type, such as both ints and floats, which NumPy would otherwise convert.
+        if len(set(map(type, values))) > 1:
+            return np.fromiter(values, dtype=object, count=len(values))
+        return Agent._column_array(values)
+
+    @staticmethod
+    def load(file):
+        """Returns a new :class:`Agent` restored from the state saved in *file* by :meth:`save`.
+        The *file* may be a file name or an open, readable binary file. The restored agent
+        has no :attr:`details` and is not traced. If *file* was not written by
+        :meth:`save`, or by a version of PyIBL using a later format, a :exc:`ValueError`
+        is raised.
+        """
+        try:
+            data = np.load(file)
+        except (OSError, ValueError):
+            data = None
+        if not isinstance(data, np.lib.npyio.NpzFile):
+            raise ValueError(f"{file} does not contain a saved Agent")
+        with data:
+            try:
+                header = pickle.loads(data["header"].tobytes())
+                if header["format"] != Agent._SAVE_FORMAT:
+                    raise ValueError
+            except Exception:
+                raise ValueError(f"{file} does not contain a saved Agent")
+            # columns of values that are not all of the same type are stored as arrays
+            # of Python objects
+            data.allow_pickle = True
+            if header["version"] > Agent._SAVE_VERSION:
+                raise ValueError(f"{file} was saved by PyIBL {header['pyibl_version']}, in a format not understood by this version, {__version__}")
+            keys = header["attributes"] or ["_decision"]
+            columns = [ data[f"queries.{k}"].tolist() for k in keys ]
+            queries = [ tuple(zip(keys, values)) for values in zip(*columns) ]
+            outcomes = data["outcomes"].tolist()
+            created = data["created"]
+            counts = data["counts"]
+            references = data["references"]
+            noise_block = data["noise_block"]
+        with warnings.catch_warnings():
+            # any warnings were issued when the saved agent's parameters were set
+            warnings.simplefilter("ignore")
+            result = Agent(name=header["name"],
+                           attributes=header["attributes"],
+                           noise=header["noise"],
+                           decay=header["decay"],
+                           temperature=header["temperature"],
+                           mismatch_penalty=header["mismatch_penalty"],
+                           optimized_learning=header["optimized_learning"],
+                           default_utility=header["default_utility"],
+                           vectorized=header["vectorized"],
+                           rng=header["rng"])
+        result.default_utility_populates = header["default_utility_populates"]
+        memory = result._memory
+        memory._own_similarity_functions.update(header["similarity_functions"])
+        memory.restore(queries, outcomes, created, counts, references)
+        memory._time = header["time"]
+        memory._noise_pool._rng = header["noise_rng"]
+        memory._noise_pool._block = noise_block
+        memory._noise_pool._next = header["noise_next"]
+        result._last_learn_time = header["last_learn_time"]
+        result._previous_choices = header["previous_choices"]
+        result._pending_decision = header["pending_decision"]
+        (result._details_every, result._details_fraction, result._details_top,
+         result._details_calls, sampler) = header["sample_details"]
+        if sampler is not None:
+            result._details_sampler = sampler
+        result._max_instances = header.get("max_instances")
+        memory._retrieval_threshold = header.get("retrieval_threshold")
+        result._approximate_blending = header.get("approximate_blending")
+        result._evicted = header.get("evicted", 0)
+        return result
 
 
 class DelayedResponse:
@@ -989,10 +1843,2560 @@ class DelayedResponse:
         self._agent._at_time(self._time,
                              lambda: self._agent._memory.learn(_utility=outcome,
                                                                **self._attributes))
+        self._agent._enforce_max_instances()
         self._resolved = True
         self._outcome = outcome
         return old
 
+class MemoryTemplate:
+    """A collection of prepopulated instances, built once and shared by any number of agents.
+    Models in which every virtual participant starts with the same, possibly large, body
+    of prepopulated instances can populate a :class:`MemoryTemplate` with them, once,
+    and pass it as the *template* when creating each :class:`Agent`. The agent then
+    starts with the template's instances, and starts with them again whenever it is
+    :meth:`Agent.reset`, while its own experiences are added on top of them, affecting
+    neither the template nor any other agent using it.
+
+    A :attr:`Agent.vectorized` agent shares the template's instances rather than copying
+    them, so creating or resetting it costs little however many instances the template
+    has, and the memory they occupy is shared by all such agents. The record of an
+    instance's references is copied by an agent only when the agent itself reinforces
+    that instance. An agent that is not vectorized is given copies of the instances when
+    it is created or reset.
+
+    The *attributes* are as for an :class:`Agent`, and the agents using a template must
+    have the same attributes, in the same order. The *optimized_learning* is whether or
+    not the agents using the template use optimized learning, which they also must
+    match; agents using the hybrid approximation, with an integer
+    :attr:`Agent.optimized_learning`, use templates that do not. Instances are added to a template with :meth:`populate` and
+    :meth:`populate_at`. A template can be populated further after agents have begun using
+    it, but the agents will only see the new instances when they are next reset.
+
+    >>> t = MemoryTemplate(["button"])
+    >>> t.populate(10, "x", "y")
+    >>> t.populate_at(3, -4, "x")
+    >>> len(t)
+    3
+    >>> a = Agent(attributes=["button"], template=t, vectorized=True)
+    >>> a.instances()
+    +--------+---------+---------+-------------+
+    | button | outcome | created | occurrences |
+    +--------+---------+---------+-------------+
+    |   x    |    10   |    0    |     [0]     |
+    |   y    |    10   |    0    |     [0]     |
+    |   x    |    3    |    -4   |     [-4]    |
+    +--------+---------+---------+-------------+
+    """
+
+    # The canonicalization of choices depends only upon the attributes, which a
+    # MemoryTemplate has just as an Agent does.
+    _canonicalize_choice = Agent._canonicalize_choice
+    _make_queries = Agent._make_queries
+
+    def __init__(self, attributes=[], optimized_learning=False):
+        self._attributes = Agent._ensure_attribute_names(list(attributes))
+        # the noise pool of this memory is never used
+        self._memory = _ArrayMemory(rng=np.random.default_rng(0),
+                                    learning_time_increment=0,
+                                    optimized_learning=optimized_learning)
+
+    def __len__(self):
+        """The number of instances in this template."""
+        return int(np.count_nonzero(self._memory._counts[:self._memory._size]))
+
+    @property
+    def attributes(self):
+        """A tuple of the names of the attributes of the instances of this template.
+        See :attr:`Agent.attributes`.
+        """
+        return tuple(self._attributes)
+
+    @property
+    def optimized_learning(self):
+        """Whether or not the agents using this template use optimized learning.
+        It is provided when the template was created, and cannot be changed thereafter.
+        """
+        return self._memory.optimized_learning
+
+    def populate(self, outcome, *choices):
+        """Adds instances to this template, one for each of the *choices*, with the given outcome, at time zero.
+        The *outcome* and *choices* are as for :meth:`Agent.populate`. Raises a
+        :exc:`ValueError` if *outcome* is not a :class:`Real` number, or if any of the
+        *choices* are malformed or duplicates.
+        """
+        self.populate_at(outcome, 0, *choices)
+
+    def populate_at(self, outcome, when, *choices):
+        """Adds instances to this template, one for each of the *choices*, with the given outcome, at the stipulated time.
+        Since an agent using the template starts at time zero, *when* must be an integer
+        no greater than zero; otherwise a :exc:`ValueError` is raised. See also
+        :meth:`Agent.populate_at`.
+        """
+        if not isinstance(when, int):
+            raise ValueError(f"Time {when} is not an integer")
+        if when > 0:
+            raise ValueError(f"Time {when} cannot be greater than zero")
+        Agent._outcome_value(outcome)
+        memory = self._memory
+        for choice in self._make_queries(choices):
+            memory._time = when
+            try:
+                memory.learn(_utility=outcome, **choice)
+            finally:
+                memory._time = 0
+
+
+class Cohort:
+    """A population of independent agents, all making the same sequence of decisions in lockstep.
+    Many models simulate a large number of virtual participants, each an :class:`Agent`
+    that is :meth:`Agent.reset` and then run through the same task. A :class:`Cohort`
+    instead simulates *size* such participants, or members, at once. The members'
+    memories are held together, in NumPy arrays, and the activations, retrieval
+    probabilities and blended values of all the members for all the choices are computed
+    together by a few vectorized operations, which is typically much faster than
+    simulating the participants one at a time. While the members share the same
+    parameters, and must make their decisions at the same times between the same
+    choices, each learns only from its own experience, and the results are the same, up
+    to the vagaries of noise, as simulating each with its own :class:`Agent`.
+
+    The *size*, a positive integer, is the number of members, and can be retrieved with
+    the :attr:`size` property. The *name* and *attributes* are as for an :class:`Agent`,
+    as are the properties :attr:`noise`, :attr:`decay`, :attr:`temperature`,
+    :attr:`optimized_learning`, :attr:`default_utility` and
+    :attr:`default_utility_populates`, and the *rng*, which is as for an :class:`Agent`,
+    except that a :class:`random.Random` is only used to seed a NumPy
+    :class:`numpy.random.Generator`. Partial matching, delayed feedback, details and
+    tracing are not supported by a :class:`Cohort`.
+
+    Raises a :exc:`ValueError` if *size* is not a positive integer.
+
+    >>> c = Cohort(10_000, default_utility=30)
+    >>> for r in range(60):
+    ...     choices = c.choose_all("safe", "risky")
+    ...     c.respond_all([0 if x == "safe" else (5 if random.random() < 0.5 else -5)
+    ...                    for x in choices])
+    ...
+    >>> choices.count("risky")
+    3967
+    """
+
+    _cohort_number = 0
+
+    # The canonicalization of choices depends only upon the attributes, which a Cohort
+    # has just as an Agent does.
+    _canonicalize_choice = Agent._canonicalize_choice
+    _make_queries = Agent._make_queries
+
+    def __init__(self,
+                 size,
+                 name=None,
+                 attributes=[],
+                 noise=pyactup.DEFAULT_NOISE,
+                 decay=pyactup.DEFAULT_DECAY,
+                 temperature=None,
+                 optimized_learning=False,
+                 default_utility=None,
+                 rng=None):
+        if not (isinstance(size, numbers.Integral) and size > 0):
+            raise ValueError(f"The size of a Cohort, {size}, must be a positive integer")
+        self._size = int(size)
+        self._attributes = Agent._ensure_attribute_names(list(attributes))
+        if name is None:
+            Cohort._cohort_number += 1
+            name = f"cohort-{Cohort._cohort_number}"
+        elif not (isinstance(name, str) and len(name) > 0):
+            raise TypeError(f"Cohort name {name} is not a non-empty string")
+        self._name = name
+        self._rng = _numpy_rng(Agent._rng_value(rng))
+        self._noise_pool = _NoisePool(self._rng)
+        self._temperature_param = 1 # will be reset below, but is needed for noise assignment
+        self._noise = None
+        self._decay = None
+        self._optimized_learning = False
+        self.noise = noise
+        self.decay = decay
+        if temperature is None and not self._validate_temperature(None, self._noise):
+            warn(f"A noise of {noise} and temperature of None will make the temperature too low; setting temperature to 1")
+            temperature = 1
+        self.temperature = temperature
+        self.default_utility = default_utility
+        self.default_utility_populates = True
+        self.reset(optimized_learning=bool(optimized_learning))
+
+    def __repr__(self):
+        return f"<Cohort {str(self)} {self._size} {id(self)}>"
+
+    def __str__(self):
+        return str(self._name)
+
+    @property
+    def name(self):
+        """The name of this Cohort.
+        It is a string, provided when the cohort was created, and cannot be changed
+        thereafter.
+        """
+        return self._name
+
+    @property
+    def size(self):
+        """The number of members of this Cohort.
+        It is provided when the cohort was created, and cannot be changed thereafter.
+        """
+        return self._size
+
+    @property
+    def attributes(self):
+        """A tuple of the names of the attributes included in all situations associated with decisions this cohort will be asked to make.
+        See :attr:`Agent.attributes`.
+        """
+        return tuple(self._attributes)
+
+    @property
+    def time(self):
+        """This cohort's current time, which is the same for all its members.
+        See :attr:`Agent.time`.
+        """
+        return self._time
+
+    @property
+    def noise(self):
+        """The amount of noise to add during instance activation computation.
+        See :attr:`Agent.noise`.
+        """
+        return self._noise
+
+    @noise.setter
+    def noise(self, value):
+        if value is None or value is False:
+            value = pyactup.DEFAULT_NOISE
+        if value < 0:
+            raise ValueError(f"The noise, {value}, must not be negative")
+        if self._temperature_param is None and not self._validate_temperature(None, value):
+            warn(f"Setting noise to {value} will make the temperature too low; setting temperature to 1")
+            self._temperature_param = 1
+        self._noise = float(value)
+
+    @property
+    def decay(self):
+        """Controls the rate at which activation for previously experienced instances in memory decay with the passage of time.
+        See :attr:`Agent.decay`.
+        """
+        return self._decay
+
+    @decay.setter
+    def decay(self, value):
+        if value is None or value is False:
+            value = pyactup.DEFAULT_DECAY
+        if value < 0:
+            raise ValueError(f"The decay, {value}, must not be negative")
+        if value >= 1 and self._optimized_learning:
+            raise ValueError(f"The decay, {value}, must be less than one if optimized_learning is True")
+        if value != self._decay:
+            self._decay = float(value)
+            self._decay_tables = _DecayTables(self._decay)
+
+    @property
+    def temperature(self):
+        """The temperature parameter used for blending values.
+        See :attr:`Agent.temperature`.
+        """
+        return self._temperature_param
+
+    @temperature.setter
+    def temperature(self, value):
+        if value is False:
+            value = None
+        if not self._validate_temperature(value, self._noise):
+            if value is None:
+                raise ValueError(f"The noise, {self._noise}, is too low to for the temperature to be set to None.")
+            else:
+                raise ValueError(f"The temperature, {value}, must not be less than {pyactup.MINIMUM_TEMPERATURE}.")
+        self._temperature_param = None if value is None else float(value)
+
+    @staticmethod
+    def _validate_temperature(temperature, noise):
+        t = temperature if temperature is not None else math.sqrt(2) * noise
+        return t if t >= pyactup.MINIMUM_TEMPERATURE else None
+
+    @property
+    def optimized_learning(self):
+        """Whether or not this :class:`Cohort` uses the optimized_learning approximation when computing instance activations.
+        This can only be changed for a :class:`Cohort` by calling :meth:`reset`.
+        """
+        return self._optimized_learning
+
+    @property
+    def default_utility(self):
+        """The utility, or a function to compute the utility, if there is no matching instance.
+        See :attr:`Agent.default_utility`. If it is a function it is called only once for
+        each choice in each call to :meth:`choose_all`, and the value it returns is used
+        for all those members lacking a matching instance.
+        """
+        return self._default_utility
+
+    @default_utility.setter
+    def default_utility(self, value):
+        if value is False:
+            value = None
+        self._callable_default_utility = not (value is None or isinstance(value, numbers.Real))
+        self._default_utility = value
+
+    @property
+    def default_utility_populates(self):
+        """Whether or not a default utility provided by the :attr:`default_utility` property is also entered as an instance in memory.
+        See :attr:`Agent.default_utility_populates`.
+        """
+        return self._default_utility_populates
+
+    @default_utility_populates.setter
+    def default_utility_populates(self, value):
+        self._default_utility_populates = bool(value)
+
+    def reset(self, preserve_prepopulated=False, optimized_learning=None):
+        """Erases the memories of all the members of this cohort and resets its time to zero.
+        The *preserve_prepopulated* and *optimized_learning* arguments are as for
+        :meth:`Agent.reset`.
+        """
+        if optimized_learning is not None:
+            if optimized_learning and self._decay >= 1:
+                raise RuntimeError(f"Optimized learning cannot be enabled if the decay, {self._decay}, is not less than 1")
+            self._optimized_learning = bool(optimized_learning)
+        if preserve_prepopulated:
+            keep = np.flatnonzero((self._counts[:self._count] > 0)
+                                  & (self._creations[:self._count] == 0))
+            preserved = (self._members[keep], self._query_ids[keep], self._outcomes[keep])
+        self._time = 0
+        self._last_learn_time = 0
+        self._previous_choices = None
+        self._pending_decision = None
+        self._count = 0
+        self._members = np.empty(0, dtype=int)
+        self._query_ids = np.empty(0, dtype=int)
+        self._outcomes = np.empty(0, dtype=float)
+        self._creations = np.empty(0, dtype=int)
+        self._counts = np.empty(0, dtype=int)
+        # Each instance has a key, unique to its member, query and outcome, as made by
+        # _keys_of(); the keys are kept sorted, with the indices of their instances, so
+        # that those of all the members can be looked up together by a binary search.
+        self._pairs = {}
+        self._keys = np.empty(0, dtype=np.int64)
+        self._key_ids = np.empty(0, dtype=int)
+        # All references of all instances are kept in a single log of instance indices
+        # and times, so base level activations can be computed by a single bincount.
+        self._reference_count = 0
+        self._reference_instances = np.empty(0, dtype=int)
+        self._reference_times = np.empty(0, dtype=int)
+        if not preserve_prepopulated:
+            self._queries = []
+            self._query_numbers = {}
+        else:
+            self._cite_all(self._add_instances(*preserved, self._keys_of(*preserved)))
+
+    @staticmethod
+    def _grow(array, needed):
+        if needed <= array.size:
+            return array
+        return np.resize(array, max(needed, 2 * array.size, 64))
+
+    def _intern(self, query):
+        query = tuple(query.items())
+        qid = self._query_numbers.get(query)
+        if qid is None:
+            qid = len(self._queries)
+            self._queries.append(query)
+            self._query_numbers[query] = qid
+        return qid
+
+    def _keys_of(self, members, qids, outcomes):
+        # Returns an array of the keys of instances for the members, qids and outcomes in
+        # the given arrays. The distinct pairs of a query and an outcome are numbered, in
+        # _pairs, and the key is that number times the size of this cohort plus the member.
+        values, value_inverse = np.unique(outcomes, return_inverse=True)
+        queries, query_inverse = np.unique(qids, return_inverse=True)
+        codes, inverse = np.unique(value_inverse.reshape(-1) * queries.size
+                                   + query_inverse.reshape(-1), return_inverse=True)
+        pairs = zip(queries[codes % queries.size].tolist(),
+                    values[codes // queries.size].tolist())
+        numbers = np.fromiter((self._pairs.setdefault(pair, len(self._pairs))
+                               for pair in pairs),
+                              dtype=np.int64, count=codes.size)
+        return numbers[inverse.reshape(-1)] * self._size + members
+
+    def _add_instances(self, members, qids, outcomes, keys):
+        # Adds instances, created at the current time, for the members, qids and outcomes
+        # in the given arrays, whose keys are also given, and returns an array of their
+        # indices.
+        start = self._count
+        self._count += members.size
+        for name in ("_members", "_query_ids", "_outcomes", "_creations", "_counts"):
+            setattr(self, name, Cohort._grow(getattr(self, name), self._count))
+        self._members[start:self._count] = members
+        self._query_ids[start:self._count] = qids
+        self._outcomes[start:self._count] = outcomes
+        self._creations[start:self._count] = self._time
+        self._counts[start:self._count] = 0
+        ids = np.arange(start, self._count)
+        order = np.argsort(keys)
+        positions = np.searchsorted(self._keys, keys[order])
+        self._keys = np.insert(self._keys, positions, keys[order])
+        self._key_ids = np.insert(self._key_ids, positions, ids[order])
+        return ids
+
+    def _cite_all(self, ids):
+        # Adds a reference at the current time to each of the instances whose indices are
+        # in ids, which must be distinct, appending them to the log all together.
+        if not self._optimized_learning:
+            j = self._reference_count
+            self._reference_count += ids.size
+            self._reference_instances = Cohort._grow(self._reference_instances,
+                                                     self._reference_count)
+            self._reference_times = Cohort._grow(self._reference_times,
+                                                 self._reference_count)
+            self._reference_instances[j:self._reference_count] = ids
+            self._reference_times[j:self._reference_count] = self._time
+        self._counts[ids] += 1
+
+    def _learn_all(self, members, qids, outcomes):
+        # Has each of the members, in an array of distinct member numbers, learn the
+        # outcome, in an array of them, of the query whose qid is in the array qids. The
+        # existing instances are found by searching the sorted keys for all of them at
+        # once, and those that are new added and all of them cited by _add_instances()
+        # and _cite_all().
+        keys = self._keys_of(members, qids, outcomes)
+        positions = np.searchsorted(self._keys, keys)
+        found = positions < self._keys.size
+        found[found] = self._keys[positions[found]] == keys[found]
+        ids = np.empty(keys.size, dtype=int)
+        ids[found] = self._key_ids[positions[found]]
+        new = np.flatnonzero(~found)
+        if new.size:
+            ids[new] = self._add_instances(members[new], qids[new], outcomes[new], keys[new])
+        self._cite_all(ids)
+
+    @staticmethod
+    def _outcome_array(outcomes):
+        # Returns an array of the outcomes, a sequence of real numbers, as floats, raising
+        # a ValueError if any of them is not a real number.
+        values = np.asarray(outcomes)
+        if values.dtype.kind not in "biuf":
+            for outcome in outcomes:
+                Agent._outcome_value(outcome)
+        return values.astype(float)
+
+    def populate(self, outcome, *choices):
+        """Adds instances to the memories of all the members of this cohort, one for each of the *choices*, with the given outcome, at the current time, without advancing that time.
+        See :meth:`Agent.populate`.
+        """
+        Agent._outcome_value(outcome)
+        members = np.arange(self._size)
+        outcomes = np.full(self._size, float(outcome))
+        for q in self._make_queries(choices):
+            self._learn_all(members, np.full(self._size, self._intern(q)), outcomes)
+        self._last_learn_time = self._time
+
+    def _blend(self, qids):
+        # Returns an array, indexed by member and choice, of blended values, NaN where a
+        # member has no instance matching a choice.
+        n = self._count
+        k = len(qids)
+        slots = np.full(len(self._queries), -1)
+        slots[qids] = np.arange(k)
+        instance_slots = slots[self._query_ids[:n]]
+        relevant = (instance_slots >= 0) & (self._counts[:n] > 0)
+        ids = np.flatnonzero(relevant)
+        if self._optimized_learning:
+            base = (np.log(self._counts[ids]) - math.log(1 - self._decay)
+                    + self._decay_tables.logs(self._time)[self._time - self._creations[ids]])
+        else:
+            owners = self._reference_instances[:self._reference_count]
+            selected = relevant[owners]
+            ages = self._time - self._reference_times[:self._reference_count][selected]
+            sums = np.bincount(owners[selected],
+                               weights=self._decay_tables.powers(self._time)[ages],
+                               minlength=n)
+            base = np.log(sums[ids])
+        if self._noise:
+            activations = base + self._noise * self._noise_pool.take(ids.size)
+        else:
+            activations = base
+        temperature = (self._temperature_param if self._temperature_param is not None
+                       else math.sqrt(2) * self._noise)
+        keys = self._members[ids] * k + instance_slots[ids]
+        maxima = np.full(self._size * k, -np.inf)
+        np.maximum.at(maxima, keys, activations)
+        weights = np.exp((activations - maxima[keys]) / temperature)
+        totals = np.bincount(keys, weights=weights, minlength=self._size * k)
+        weighted = np.bincount(keys, weights=weights * self._outcomes[ids],
+                               minlength=self._size * k)
+        with np.errstate(invalid="ignore"):
+            return (weighted / totals).reshape(self._size, k)
+
+    def choose_all(self, *choices):
+        """Selects, for each member of this cohort, which of the *choices* is expected to result in the largest payoff, and returns a list of them.
+        The *choices* are as for :meth:`Agent.choose`, and, as there, if none are
+        supplied those of the previous call to :meth:`choose_all` are used. The list
+        returned has one element for each member, the choice selected by that member.
+
+        After a call to :meth:`choose_all` a corresponding call must be made to
+        :meth:`respond_all` before calling :meth:`choose_all` again, or a
+        :exc:`RuntimeError` will be raised.
+        """
+        if self._pending_decision:
+            raise RuntimeError("choice requested before previous outcomes were supplied")
+        choices = list(choices)
+        if not choices:
+            if self._previous_choices:
+                choices = self._previous_choices
+            else:
+                raise ValueError("no choices were supplied and no default ones are available")
+        qids = [ self._intern(q) for q in self._make_queries(choices) ]
+        self._previous_choices = choices
+        if self._last_learn_time >= self._time:
+            self._time = self._last_learn_time + 1
+        utilities = self._blend(qids)
+        missing = np.isnan(utilities)
+        for j in np.flatnonzero(missing.any(axis=0)):
+            if self._default_utility is None:
+                raise RuntimeError(f"No experience available for choice {choices[j]}")
+            if self._callable_default_utility:
+                u = self._default_utility(choices[j])
+            else:
+                u = self._default_utility
+            members = np.flatnonzero(missing[:, j])
+            utilities[members, j] = u
+            if self._default_utility_populates:
+                saved = self._time
+                try:
+                    self._time = 0
+                    self._learn_all(members, np.full(members.size, qids[j]),
+                                    np.full(members.size, float(u)))
+                finally:
+                    self._time = saved
+        # Break ties at random by choosing the largest of random numbers assigned to the
+        # choices with the best utility.
+        best = utilities == utilities.max(axis=1, keepdims=True)
+        best = np.argmax(self._rng.random(best.shape) * best, axis=1)
+        self._pending_decision = (best, choices, qids)
+        return [ choices[i] for i in best ]
+
+    def respond_all(self, outcomes):
+        """Provide the *outcomes* resulting from the decisions most recently selected by :meth:`choose_all`.
+        The *outcomes* should be a sequence of real numbers, one for each member of this
+        cohort, in the same order as the choices returned by :meth:`choose_all`.
+
+        If there has not been a call to :meth:`choose_all` since the last time
+        :meth:`respond_all` was called a :exc:`RuntimeError` is raised. If *outcomes* is
+        not of the same length as the :attr:`size` of this cohort, or any of its elements
+        is not a real number, a :exc:`ValueError` is raised.
+        """
+        if not self._pending_decision:
+            raise RuntimeError("outcomes supplied when no decisions requiring them are pending")
+        best, choices, qids = self._pending_decision
+        outcomes = list(outcomes)
+        if len(outcomes) != self._size:
+            raise ValueError(f"{len(outcomes)} outcomes were supplied for {self._size} members")
+        self._learn_all(np.arange(self._size), np.asarray(qids)[best],
+                        Cohort._outcome_array(outcomes))
+        self._last_learn_time = self._time
+        self._pending_decision = None
+
+
+class DetailsRecorder:
+    """A sink for the details of an :class:`Agent`'s computations that stores them in columns, rather than as dictionaries.
+    An instance of this class may be assigned to an agent's :attr:`Agent.details` in
+    place of a list. The same information is then recorded, but appended to NumPy arrays,
+    preallocated with room for *capacity* rows and doubled in size as necessary, rather
+    than built into a dictionary for every instance activated, which is both much faster
+    and much more compact. The recording is cheapest for a :attr:`Agent.vectorized`
+    agent, whose activations are already computed as arrays.
+
+    The details are recorded in two tables, each a dictionary mapping column names to
+    NumPy arrays of equal length, as returned by :meth:`choices` and :meth:`activations`.
+    The former has a row for every choice considered in every call to :meth:`Agent.choose`,
+    the latter a row for every instance activated in blending the value of such a choice.
+    Both have a ``decision`` column, numbering the calls to :meth:`Agent.choose` recorded,
+    starting at zero, by which they can be joined; the activations table also has a
+    ``choice_row`` column, the index of the row of the choices table to which it belongs.
+    A recorder may be shared by several agents, provided they all have the same
+    attributes; if an attempt is made to record choices with different attributes a
+    :exc:`ValueError` is raised.
+
+    The choices table also has columns ``time``, the agent's time at the decision,
+    ``blended``, the blended value of the choice, and a column for each of the agent's
+    attributes, or a ``choice`` column if it has none. The activations table has columns
+    ``name``, ``creation_time``, ``reference_count``, ``utility``, ``base_activation``,
+    ``activation_noise``, ``mismatch``, ``activation`` and ``retrieval_probability``,
+    corresponding to the like named values in the dictionaries recorded in a list,
+    except that ``reference_count`` is the number of references to the instance, and
+    ``mismatch`` is NaN if the agent is not partially matching.
+
+    The details can be saved to a NumPy ``.npz`` file with :meth:`save_npz`, or converted
+    to Apache Arrow tables, which can in turn be written to Parquet files, with
+    :meth:`to_arrow`.
+
+    >>> r = DetailsRecorder()
+    >>> a = Agent(default_utility=10, vectorized=True)
+    >>> a.details = r
+    >>> a.choose("a", "b")
+    'b'
+    >>> a.respond(5)
+    >>> a.choose()
+    'a'
+    >>> r.choices()["choice"]
+    array(['a', 'b', 'a', 'b'], dtype=object)
+    >>> r.activations()["choice_row"]
+    array([2, 3, 3])
+    >>> r.activations()["utility"]
+    array([10., 10.,  5.])
+    """
+
+    _CHOICE_COLUMNS = (("decision", int), ("time", int), ("blended", float))
+
+    _ACTIVATION_COLUMNS = (("decision", int),
+                           ("choice_row", int),
+                           ("name", object),
+                           ("creation_time", int),
+                           ("reference_count", int),
+                           ("utility", float),
+                           ("base_activation", float),
+                           ("activation_noise", float),
+                           ("mismatch", float),
+                           ("activation", float),
+                           ("retrieval_probability", float))
+
+    def __init__(self, capacity=1024):
+        if not (isinstance(capacity, numbers.Integral) and capacity > 0):
+            raise ValueError(f"capacity, {capacity}, must be a positive integer")
+        self._capacity = int(capacity)
+        self.clear()
+
+    def __len__(self):
+        """The number of calls to :meth:`Agent.choose` recorded."""
+        return self._decisions
+
+    def clear(self):
+        """Discards all the details recorded so far."""
+        self._decisions = 0
+        self._attributes = None
+        self._choices = None
+        self._activations = _ColumnBuffer(DetailsRecorder._ACTIVATION_COLUMNS,
+                                          self._capacity)
+
+    def choices(self):
+        """Returns a dictionary mapping the names of the columns of the choices table to NumPy arrays of their values.
+        The arrays are views of this recorder's buffers, and should be copied if they
+        are to be retained while further details are recorded.
+        """
+        if self._choices is None:
+            return _ColumnBuffer(DetailsRecorder._CHOICE_COLUMNS, 1).columns()
+        return self._choices.columns()
+
+    def activations(self):
+        """Returns a dictionary mapping the names of the columns of the activations table to NumPy arrays of their values.
+        The arrays are views of this recorder's buffers, and should be copied if they
+        are to be retained while further details are recorded.
+        """
+        return self._activations.columns()
+
+    def save_npz(self, file, compressed=True):
+        """Saves the details recorded so far to the NumPy ``.npz`` *file*.
+        The *file* may be a file name or an open, writable binary file. The arrays are
+        named by prefixing the column names with ``choices.`` or ``activations.``, as
+        in ``choices.blended``. Columns of arbitrary Python objects, such as the names
+        of instances or the values of attributes, are saved as strings unless they can
+        be converted to some other NumPy type, so that the file can be loaded without
+        pickling. If *compressed* is true, the default, the file is compressed.
+        """
+        arrays = {}
+        for prefix, columns in (("choices", self.choices()),
+                                ("activations", self.activations())):
+            for name, values in columns.items():
+                arrays[f"{prefix}.{name}"] = DetailsRecorder._portable(values)
+        (np.savez_compressed if compressed else np.savez)(file, **arrays)
+
+    @staticmethod
+    def _portable(values):
+        if values.dtype != object:
+            return values
+        values = values.tolist()
+        if all(isinstance(v, numbers.Number) for v in values):
+            result = np.array(values)
+            if result.dtype != object:
+                return result
+        return np.array([ str(v) for v in values ], dtype=str)
+
+    def to_arrow(self):
+        """Returns the details recorded so far as a pair of Apache Arrow tables, of the choices and of the activations.
+        This requires the :mod:`pyarrow` package, which is not otherwise needed by PyIBL;
+        if it is not installed an :exc:`ImportError` is raised. The tables can be written
+        to Parquet files with :func:`pyarrow.parquet.write_table`.
+        """
+        import pyarrow
+        return tuple(pyarrow.table({name: DetailsRecorder._portable(values)
+                                    for name, values in columns.items()})
+                     for columns in (self.choices(), self.activations()))
+
+    def _record(self, agent, queries, utilities, histories):
+        # Records one call of agent.choose(), for each of whose queries there is a
+        # blended value and a history, either a list of dicts in the form of pyactup's
+        # activation_history, a dict of arrays as produced by _ArrayMemory.blend_all(), or
+        # empty or None if there were no matching instances.
+        attributes = list(agent._attributes) or ["choice"]
+        if self._choices is None:
+            self._attributes = attributes
+            self._choices = _ColumnBuffer(DetailsRecorder._CHOICE_COLUMNS +
+                                          tuple((a, object) for a in attributes),
+                                          self._capacity)
+        elif attributes != self._attributes:
+            raise ValueError(f"{agent} has attributes {attributes}, but details have already been recorded for attributes {self._attributes}")
+        decision = self._decisions
+        first_row = len(self._choices)
+        values = ([ q[a] for q in queries ] for a in (agent._attributes or ["_decision"]))
+        self._choices.extend(len(queries),
+                             decision=decision,
+                             time=agent.time,
+                             blended=utilities,
+                             **dict(zip(attributes, values)))
+        for row, history in enumerate(histories, first_row):
+            if not history:
+                continue
+            if isinstance(history, dict):
+                self._activations.extend(len(history["name"]),
+                                         decision=decision,
+                                         choice_row=row,
+                                         **history)
+            else:
+                self._activations.extend(len(history),
+                                         decision=decision,
+                                         choice_row=row,
+                                         **DetailsRecorder._history_columns(history))
+        self._decisions += 1
+
+    @staticmethod
+    def _history_columns(history):
+        references = [ h["references"] for h in history ]
+        return {"name": [ h["name"] for h in history ],
+                "creation_time": [ h["creation_time"] for h in history ],
+                "reference_count": [ r if isinstance(r, numbers.Integral) else len(r)
+                                     for r in references ],
+                "utility": [ h["attributes"][0][1] for h in history ],
+                "base_activation": [ h["base_activation"] for h in history ],
+                "activation_noise": [ h["activation_noise"] for h in history ],
+                "mismatch": [ h.get("mismatch", math.nan) for h in history ],
+                "activation": [ h["activation"] for h in history ],
+                "retrieval_probability": [ h["retrieval_probability"] for h in history ]}
+
+
+def _json_default(value):
+    # NumPy scalars and arrays, as in the references of a plain Agent's instances, are
+    # written as the numbers and lists they hold; anything else JSON cannot represent
+    # as a string.
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+class _BackgroundWriter:
+    # The machinery shared by DetailsWriter and TraceWriter: records appended in the
+    # calling thread are delivered by a background thread, through a queue of bounded
+    # size, so that appending blocks if the background thread falls too far behind.
+    # Subclasses set _file, _owns_file and _deliver, and implement _write(record).
+
+    def __init__(self, buffer_size):
+        self._buffer = queue.Queue(buffer_size)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _check_buffer_size(buffer_size):
+        if not (isinstance(buffer_size, numbers.Integral) and buffer_size > 0):
+            raise ValueError(f"buffer_size, {buffer_size}, must be a positive integer")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        """Whether or not this writer has been closed."""
+        return self._closed
+
+    def append(self, record):
+        """Queues *record* to be delivered by the background thread.
+        This is called by an :class:`Agent` using this writer, and blocks if
+        *buffer_size* records are already waiting. A :exc:`RuntimeError` is raised if
+        this writer has been closed.
+        """
+        self._raise_error()
+        if self._closed:
+            raise RuntimeError(f"nothing can be written to a closed {type(self).__name__}")
+        self._buffer.put(record)
+
+    def flush(self):
+        """Waits until all the records so far appended have been delivered."""
+        self._buffer.join()
+        self._raise_error()
+
+    def close(self):
+        """Waits until all the records so far appended have been delivered, and stops the background thread.
+        If the destination was a file name the file is closed. Closing a writer that is
+        already closed has no effect.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._buffer.put(None)
+        self._thread.join()
+        if self._owns_file:
+            self._file.close()
+        elif self._file is not None:
+            self._file.flush()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _run(self):
+        while True:
+            record = self._buffer.get()
+            try:
+                if record is None:
+                    return
+                if self._error is None:
+                    self._write(record)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._buffer.task_done()
+
+
+class DetailsWriter(_BackgroundWriter):
+    """A sink for the details of an :class:`Agent`'s computations that streams them elsewhere, rather than accumulating them in memory.
+    An instance of this class may be assigned to an agent's :attr:`Agent.details` in
+    place of a list. The details of each call to :meth:`Agent.choose`, the same list of
+    dictionaries as would be appended to a list, are handed to a background thread,
+    which delivers them to *destination*. This may be
+
+    * a file name, or an open file, to which the details are written, one record for
+      each call to :meth:`Agent.choose`, in the *format* ``"jsonl"``, the default, in
+      which each record is a line of JSON, or ``"binary"``, in which each is a
+      :mod:`pickle`; the records in a file can be read back with :meth:`read`
+
+    * a callable, which is called with each record, in the background thread
+
+    * a :class:`queue.Queue`, onto which each record is put.
+
+    At most *buffer_size* records are held waiting to be delivered. If the background
+    thread falls that far behind, a call to :meth:`Agent.choose` waits for it to catch
+    up, so that however long a model runs the memory used by its details is bounded.
+
+    A writer should be closed with :meth:`close` when it is no longer needed, which
+    waits for all the records to be delivered, and closes the file if *destination* was
+    a file name; a writer can also be used as a context manager, which closes it on
+    exit. Writers not explicitly closed are closed when Python exits. If delivering a
+    record raises an exception it is raised again, in the thread using the writer, by
+    the next call to :meth:`Agent.choose` or :meth:`close`.
+
+    A :exc:`ValueError` is raised if *format* is neither ``"jsonl"`` nor ``"binary"``,
+    or if *buffer_size* is not a positive integer.
+
+    >>> with DetailsWriter("details.jsonl") as w:
+    ...     a = Agent(default_utility=10)
+    ...     a.details = w
+    ...     for i in range(1000):
+    ...         a.choose("a", "b")
+    ...         a.respond(i % 7)
+    ...
+    >>> sum(1 for r in DetailsWriter.read("details.jsonl"))
+    1000
+    """
+
+    _FORMATS = ("jsonl", "binary")
+
+    def __init__(self, destination, format="jsonl", buffer_size=1024):
+        if format not in DetailsWriter._FORMATS:
+            raise ValueError(f"format, {format}, must be one of {', '.join(DetailsWriter._FORMATS)}")
+        _BackgroundWriter._check_buffer_size(buffer_size)
+        self._format = format
+        self._file = None
+        self._owns_file = False
+        self._deliver = None
+        if isinstance(destination, queue.Queue):
+            self._deliver = destination.put
+        elif isinstance(destination, (str, os.PathLike)):
+            self._file = open(destination, "w" if format == "jsonl" else "wb")
+            self._owns_file = True
+        elif hasattr(destination, "write"):
+            self._file = destination
+        elif callable(destination):
+            self._deliver = destination
+        else:
+            raise ValueError(f"{destination} is not a file, callable or queue")
+        super().__init__(buffer_size)
+
+    def _write(self, record):
+        if self._deliver is not None:
+            self._deliver(record)
+        elif self._format == "jsonl":
+            self._file.write(json.dumps(record, default=_json_default))
+            self._file.write("\n")
+        else:
+            pickle.dump(record, self._file)
+
+    @staticmethod
+    def read(file, format="jsonl"):
+        """Iterates over the records in *file*, as written by a :class:`DetailsWriter` in *format*.
+        The *file* may be a file name or an open file. In the ``"jsonl"`` format tuples,
+        such as the attributes of instances, and NumPy arrays are read back as lists,
+        NumPy numbers as Python ones, and other values that cannot be represented in JSON
+        as strings.
+        """
+        if format not in DetailsWriter._FORMATS:
+            raise ValueError(f"format, {format}, must be one of {', '.join(DetailsWriter._FORMATS)}")
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "r" if format == "jsonl" else "rb") as f:
+                yield from DetailsWriter.read(f, format)
+            return
+        if format == "jsonl":
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    return
+
+
+class TraceWriter(_BackgroundWriter):
+    """A destination for the trace of an :class:`Agent`'s computations, which formats and writes it in a background thread.
+    An instance of this class may be assigned to an agent's :attr:`Agent.trace`, instead
+    of ``True``, in which case the values that would otherwise be printed are handed to
+    a background thread, which formats them and delivers them to *destination*, so that
+    the model need not wait for the formatting or output. The *destination* may be
+
+    * a file name, or an open text file, to which the trace is written
+
+    * a :class:`logging.Logger`, to which the trace is logged at *level*, by default
+      :data:`logging.INFO`
+
+    * a callable, which is called with the text of the trace, in the background thread.
+
+    If *format* is ``"table"``, the default, the trace of each call to
+    :meth:`Agent.choose` is the same text as would be printed when :attr:`Agent.trace`
+    is ``True``, written, logged, or passed to the callable all at once. If it is
+    ``"compact"`` the trace of each choice considered is instead a line of JSON, written,
+    logged, or passed to the callable separately. Each such line is an object with the
+    keys ``agent``, the agent's name, ``time``, ``choice``, a dictionary of the attribute
+    values of the choice, or the choice itself if the agent has no attributes,
+    ``blended``, the blended value of the choice, and ``instances``, a list with an
+    element for each instance activated, itself a list of the instance's name, creation
+    time, references (or number of references, if :attr:`Agent.optimized_learning` is
+    true), outcome, base activation, activation noise, mismatch adjustment (``null`` if
+    the agent is not partially matching), total activation and retrieval probability.
+
+    As for a :class:`DetailsWriter`, at most *buffer_size* traces are held waiting to be
+    delivered, a call to :meth:`Agent.choose` waiting if there are that many, and a
+    writer should be closed, with :meth:`close` or by using it as a context manager,
+    when it is no longer needed. A :exc:`ValueError` is raised if *format* is neither
+    ``"table"`` nor ``"compact"``, or if *buffer_size* is not a positive integer.
+
+    >>> with TraceWriter("trace.jsonl", format="compact") as w:
+    ...     a = Agent(default_utility=10)
+    ...     a.trace = w
+    ...     a.choose("a", "b")
+    ...     a.respond(7)
+    ...
+    'b'
+    >>> print(open("trace.jsonl").readline(), end="")
+    {"agent": "agent-1", "time": 1, "choice": "a", "blended": 10, "instances": []}
+    """
+
+    _FORMATS = ("table", "compact")
+
+    def __init__(self, destination, format="table", buffer_size=1024, level=logging.INFO):
+        if format not in TraceWriter._FORMATS:
+            raise ValueError(f"format, {format}, must be one of {', '.join(TraceWriter._FORMATS)}")
+        _BackgroundWriter._check_buffer_size(buffer_size)
+        self._format = format
+        self._file = None
+        self._owns_file = False
+        self._deliver = None
+        if isinstance(destination, logging.Logger):
+            self._deliver = functools.partial(destination.log, level)
+        elif isinstance(destination, (str, os.PathLike)):
+            self._file = open(destination, "w")
+            self._owns_file = True
+        elif hasattr(destination, "write"):
+            self._file = destination
+        elif callable(destination):
+            self._deliver = destination
+        else:
+            raise ValueError(f"{destination} is not a file, logger or callable")
+        super().__init__(buffer_size)
+
+    def _write(self, record):
+        name, time, attributes, mismatch, optimized_learning, traces = record
+        if self._format == "table":
+            texts = ["".join(Agent._trace_table(attributes, mismatch, optimized_learning,
+                                                *t)
+                             for t in traces)
+                     + Agent._TRACE_SEPARATOR]
+        else:
+            texts = [ json.dumps({"agent": name,
+                                  "time": time,
+                                  "choice": dict(query) if attributes else query["_decision"],
+                                  "blended": utility,
+                                  "instances": [ [h["name"],
+                                                  h["creation_time"],
+                                                  (int(h["references"]) if optimized_learning
+                                                   else [ int(r) for r in h["references"] ]),
+                                                  dict(h["attributes"])["_utility"],
+                                                  h["base_activation"],
+                                                  h["activation_noise"],
+                                                  h.get("mismatch"),
+                                                  h["activation"],
+                                                  h["retrieval_probability"]]
+                                                for h in history ]},
+                                 default=_json_default)
+                      for query, utility, history in traces ]
+        for text in texts:
+            if self._deliver is not None:
+                self._deliver(text)
+            else:
+                self._file.write(text)
+                self._file.write("\n")
+
+
+ReplicateResult = namedtuple("ReplicateResult", ["replicate", "seed", "result"])
+
+def replicate_seed(seed, replicate):
+    """Returns the seed used for the given *replicate* by :func:`run_parallel` when called with master *seed*.
+    The value is a non-negative integer depending only upon *seed* and *replicate*, and
+    not upon the number of replicates or processes.
+    """
+    return int(np.random.SeedSequence(seed, spawn_key=(replicate,)).generate_state(1, np.uint64)[0])
+
+def _run_replicate(task_fn, replicate, seed):
+    random.seed(seed)
+    return ReplicateResult(replicate, seed, task_fn(replicate))
+
+def run_parallel(task_fn, n_replicates, processes=None, seed=None):
+    """Runs *n_replicates* independent replicates of a model, such as virtual participants, sharded across a pool of processes, and returns their results.
+    The *task_fn* is called once for each replicate with one argument, the index of the
+    replicate, an integer from zero to one less than *n_replicates*, and should return
+    the results of that replicate, which must be picklable. As it is called in other
+    processes *task_fn* must itself be picklable, typically a function defined at the
+    top level of a module, and it should create any :class:`Agent` or :class:`Cohort`
+    it uses.
+
+    Before *task_fn* is called for a replicate the Python :mod:`random` module is seeded
+    with a seed derived from the master *seed*, which is also used, in turn, to seed the
+    activation noise of any :class:`Agent` or :class:`Cohort` created by *task_fn*
+    without an explicit *rng*, as well as their breaking of ties. Thus for a given
+    master *seed* the results are identical however many processes are used. If *seed* is ``None`` a master seed is
+    drawn from the :mod:`random` module. The seed used for each replicate can also be
+    computed with :func:`replicate_seed`.
+
+    The *processes* is the number of worker processes to use; if ``None`` the number
+    of CPUs is used. If it is ``1`` the replicates are instead run sequentially in the
+    current process, which can be helpful for debugging; the state of the
+    :mod:`random` module is restored afterwards.
+
+    Returns a list of :class:`ReplicateResult` named tuples, in replicate order, with
+    slots ``replicate``, ``seed`` and ``result``, the last being the value returned by
+    *task_fn*.
+
+    >>> def participant(i):
+    ...     a = Agent(default_utility=30)
+    ...     risky = 0
+    ...     for r in range(60):
+    ...         if a.choose("safe", "risky") == "safe":
+    ...             a.respond(0)
+    ...         else:
+    ...             risky += 1
+    ...             a.respond(5 if random.random() < 0.5 else -5)
+    ...     return risky
+    >>> results = run_parallel(participant, 1000, seed=2021)
+    >>> results[0]
+    ReplicateResult(replicate=0, seed=2654326498570982340, result=28)
+    >>> sum(r.result for r in results) / 1000
+    25.073
+    """
+    if not (isinstance(n_replicates, numbers.Integral) and n_replicates >= 0):
+        raise ValueError(f"The number of replicates, {n_replicates}, is not a non-negative integer")
+    if processes is not None and not (isinstance(processes, numbers.Integral) and processes > 0):
+        raise ValueError(f"The number of processes, {processes}, is not a positive integer")
+    if seed is None:
+        seed = random.getrandbits(64)
+    replicates = range(n_replicates)
+    seeds = [ replicate_seed(seed, i) for i in replicates ]
+    if processes == 1:
+        state = random.getstate()
+        try:
+            return [ _run_replicate(task_fn, i, s) for i, s in zip(replicates, seeds) ]
+        finally:
+            random.setstate(state)
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_run_replicate, repeat(task_fn), replicates, seeds,
+                                 chunksize=max(1, n_replicates // (4 * processes))))
+
+
+# Yielded by blending in place of the blended value of a choice that was skipped as it
+# could not be greater than that of another.
+_DOMINATED = object()
+
+
+def _split_optimized_learning(value):
+    # Returns, for a value of optimized_learning as passed to reset(), which may be None,
+    # True, False or a positive integer, the value to be passed to pyactup's reset(), and
+    # the number of most recent references to each instance whose contributions to its
+    # base level activation are computed exactly by the hybrid approximation, or None if
+    # it is not used.
+    if value is None or isinstance(value, bool) or not isinstance(value, numbers.Integral):
+        return value, None
+    if value < 1:
+        raise ValueError(f"optimized_learning, {value}, is neither a Boolean nor a positive integer")
+    return False, int(value)
+
+
+def _older_references(older, kth, oldest, decay):
+    # Returns Petrov's approximation of the sums of age^-decay over the older references
+    # to instances, other than the most recent ones whose contributions are computed
+    # exactly, from the numbers of them, older, and the ages of the least recent of those
+    # recent ones, kth, and of the instances themselves, oldest. The references are taken
+    # to be spread evenly between those two, so that each contributes the mean of
+    # age^-decay over them, which is computed in closed form.
+    kth = np.asarray(kth, dtype=float)
+    oldest = np.asarray(oldest, dtype=float)
+    if decay == 1:
+        integral = np.log(oldest / kth)
+    else:
+        integral = (oldest ** (1 - decay) - kth ** (1 - decay)) / (1 - decay)
+    # where there is no span the mean is simply that at kth
+    span = oldest - kth
+    mean = np.array(kth ** -decay)
+    np.divide(integral, span, out=mean, where=(span > 0))
+    return older * mean
+
+
+def _numpy_rng(rng):
+    # Returns a NumPy Generator that is rng itself, or is seeded from rng if it is a
+    # random.Random, or from the random module if rng is None, so that seeding the latter
+    # suffices for reproducible results, just as for a pyactup.Memory.
+    if isinstance(rng, np.random.Generator):
+        return rng
+    return np.random.default_rng((rng or random).getrandbits(128))
+
+
+class _ColumnBuffer:
+    # A table of equal length columns, each a preallocated NumPy array that is doubled in
+    # size whenever it fills up. Rows are only ever appended, several at a time.
+
+    def __init__(self, dtypes, capacity):
+        self._size = 0
+        self._arrays = { name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes }
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, n, **values):
+        # Appends n rows; each of values is a scalar, filling all n rows, or a sequence of
+        # length n. Columns for which no value is supplied are filled with NaN.
+        end = self._size + n
+        for name, array in self._arrays.items():
+            if end > array.size:
+                array = np.resize(array, max(end, 2 * array.size))
+                self._arrays[name] = array
+            value = values.get(name)
+            if value is None:
+                value = math.nan
+            elif array.dtype == object and not isinstance(value, (str, numbers.Number)):
+                # so that values that are themselves sequences, such as tuples, are
+                # not unpacked
+                value = np.fromiter(value, dtype=object, count=n)
+            array[self._size:end] = value
+        self._size = end
+
+    def columns(self):
+        return { name: array[:self._size] for name, array in self._arrays.items() }
+
+
+class _NoisePool:
+    # Standard logistic noise, generated in large blocks by a NumPy Generator and handed
+    # out in slices, a fresh block being generated lazily when one is exhausted. It exists
+    # for the vectorized memories and Cohorts, which need the noise of many instances at
+    # once as an array, from a Generator that can be the Agent's own; pyactup's Memory,
+    # though it too draws its noise in blocks, hands it out only one sample at a time,
+    # from a Generator of its own seeded from the random module. The samples handed out
+    # are the same however they are requested, singly or in slices of whatever sizes, and
+    # the plain _Memory takes them singly, so that every agent's noise comes from its own
+    # rng. Scaling by the noise parameter is left to the caller, so that changing that
+    # parameter takes effect at once.
+
+    BLOCK_SIZE = 16_384
+
+    def __init__(self, rng):
+        self._rng = rng
+        self._block = np.empty(0)
+        self._next = 0
+
+    def take(self, n):
+        # Returns an array of n samples; it may be a view of the block, so should not be
+        # modified in place.
+        if self._next + n > self._block.size:
+            self._block = np.concatenate((self._block[self._next:],
+                                          self._rng.logistic(size=max(n, _NoisePool.BLOCK_SIZE))))
+            self._next = 0
+        result = self._block[self._next:self._next + n]
+        self._next += n
+        return result
+
+    def next(self):
+        # Returns a single sample, as a float.
+        if self._next >= self._block.size:
+            self._block = self._rng.logistic(size=_NoisePool.BLOCK_SIZE)
+            self._next = 0
+        result = self._block[self._next]
+        self._next += 1
+        return result.item()
+
+
+class _SimilarityFunctions:
+    # Mixed into the Memories used by an Agent so that they can have similarity functions
+    # of their own, consulted before those set for the whole process with
+    # pyactup.set_similarity_function. Their values are cached separately from the
+    # process wide cache, which is shared by all Memories and keyed only by the values
+    # compared and the attribute name.
+
+    def _init_similarity_functions(self):
+        self._own_similarity_functions = {}
+        self._own_similarity_cache = {}
+        self._similarity_functions = ChainMap(self._own_similarity_functions,
+                                              pyactup.Memory._similarity_functions)
+
+    def __getstate__(self):
+        # The process wide similarity functions are not part of a Memory's state; an
+        # unpickled Memory uses those of the process into which it is unpickled.
+        state = self.__dict__.copy()
+        del state["_similarity_functions"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._similarity_functions = ChainMap(self._own_similarity_functions,
+                                              pyactup.Memory._similarity_functions)
+
+    def set_similarity_function(self, function, *attributes):
+        for a in attributes:
+            if function:
+                self._own_similarity_functions[a] = function
+            else:
+                self._own_similarity_functions.pop(a, None)
+        self._own_similarity_cache.clear()
+
+    def _similarity(self, x, y, attribute):
+        function = self._own_similarity_functions.get(attribute)
+        if function is None:
+            return super()._similarity(x, y, attribute)
+        if x == y:
+            return 1
+        if function is True:
+            return 0
+        cache = self._own_similarity_cache
+        result = cache.get((x, y, attribute))
+        if result is not None:
+            return result
+        result = cache.get((y, x, attribute))
+        if result is not None:
+            return result
+        result = function(x, y)
+        low = pyactup.Memory._minimum_similarity
+        high = pyactup.Memory._maximum_similarity
+        if result < low:
+            warn(f"similarity value is less than the minimum allowed, {low}, so that minimum value is being used instead")
+            result = low
+        elif result > high:
+            warn(f"similarity value is greater than the maximum allowed, {high}, so that maximum value is being used instead")
+            result = high
+        if pyactup.Memory._use_actr_similarity:
+            result += 1
+        if len(cache) >= pyactup.SIMILARITY_CACHE_SIZE:
+            cache.clear()
+        cache[(x, y, attribute)] = result
+        return result
+
+
+class _Memory(_SimilarityFunctions, pyactup.Memory):
+    # The pyactup.Memory used by an Agent that is not vectorized, differing only in
+    # drawing its activation noise from a _NoisePool, of a random number generator of the
+    # Agent's own or seeded from the random module, rather than from pyactup's own
+    # Generator, and in having similarity functions of its own. Within fixed_noise an instance's noise is remembered, as usual, so it is the
+    # same for all the blends of a choose().
+
+    def __init__(self, rng=None, **kwargs):
+        self._noise_pool = _NoisePool(_numpy_rng(rng))
+        self._init_similarity_functions()
+        super().__init__(**kwargs)
+
+    # The number of most recent references to each chunk whose contributions to its base
+    # level activation are computed exactly when using the hybrid approximation, or None
+    # if it is not being used.
+    _exact_references = None
+
+    def reset(self, preserve_prepopulated=False, optimized_learning=None):
+        learning, exact = _split_optimized_learning(optimized_learning)
+        super().reset(preserve_prepopulated=preserve_prepopulated,
+                      optimized_learning=learning)
+        if learning is not None:
+            self._exact_references = exact
+
+    def match_all(self, queries):
+        # Returns a list of the chunks exactly matching each of the queries, dicts of
+        # attribute values all having the same attributes, found in a single pass over
+        # memory, having drawn, within fixed_noise, the noise of all of them in the order
+        # in which it would be drawn were the queries blended in turn. A query can then be
+        # blended over only its own chunks by setting _candidates to them.
+        positions = { tuple(q.values()): j for j, q in enumerate(queries) }
+        names = list(queries[0].keys())
+        matches = [ [] for q in queries ]
+        for chunk in self.values():
+            j = positions.get(tuple(map(chunk.get, names)))
+            if j is not None:
+                matches[j].append(chunk)
+        for chunks in matches:
+            for chunk in chunks:
+                self._make_noise(chunk)
+        return matches
+
+    def fork(self, rng):
+        # Returns a copy of this Memory, with chunks of its own, drawing its noise from rng.
+        result = copy.deepcopy(self)
+        result._noise_pool = _NoisePool(_numpy_rng(rng))
+        return result
+
+    def instance_columns(self, attributes, chunk_size):
+        # Yields, for successive chunks of at most chunk_size instances, in the order in
+        # which they were created, a dict mapping each of the attributes, "_utility",
+        # "created" and "occurrences" to a sequence of the values of those instances.
+        chunks = iter(self.values())
+        while True:
+            chunk_list = list(islice(chunks, chunk_size))
+            if not chunk_list:
+                return
+            result = { a: [ c[a] for c in chunk_list ] for a in attributes }
+            result["_utility"] = [ c["_utility"] for c in chunk_list ]
+            result["created"] = [ c._creation for c in chunk_list ]
+            result["occurrences"] = [ self._chunk_references(c) for c in chunk_list ]
+            yield result
+
+    def snapshot(self, keys):
+        # Returns, for the instances in the order in which they were created, a list of
+        # their queries, tuples of the given attribute names and their values, a list of
+        # their outcomes, and arrays of their creation times, of their numbers of
+        # references, and, unless using optimized learning, of all their references,
+        # concatenated.
+        chunks = list(self.values())
+        counts = []
+        references = []
+        for c in chunks:
+            r = self._chunk_references(c)
+            if self._optimized_learning:
+                counts.append(r)
+            else:
+                counts.append(len(r))
+                references.extend(r)
+        return ([ tuple((k, c[k]) for k in keys) for c in chunks ],
+                [ c["_utility"] for c in chunks ],
+                np.array([ c._creation for c in chunks ], dtype=int),
+                np.array(counts, dtype=int),
+                np.array(references, dtype=int))
+
+    def restore(self, queries, outcomes, created, counts, references):
+        # Replaces the instances with those described by the values returned by snapshot().
+        # The chunks are re-created by learning them again at the times of their
+        # references, in order, or, if using optimized learning, as often as they were
+        # referenced at their creation times.
+        self.reset()
+        if self._optimized_learning:
+            events = [ (t, j) for j, (t, n) in enumerate(zip(created.tolist(), counts.tolist()))
+                       for k in range(n) ]
+        else:
+            owners = np.repeat(np.arange(len(queries)), counts)
+            order = np.argsort(references, kind="stable")
+            events = zip(references[order].tolist(), owners[order].tolist())
+        saved = self._time
+        try:
+            for t, j in events:
+                self._time = t
+                self.learn(_utility=outcomes[j], **dict(queries[j]))
+        finally:
+            self._time = saved
+        creations = { (q, o): t for q, o, t in zip(queries, outcomes, created.tolist()) }
+        keys = [ k for k, v in queries[0] ] if queries else []
+        for c in self.values():
+            c._creation = creations[(tuple((k, c[k]) for k in keys), c["_utility"])]
+
+    def instance_count(self):
+        return len(self)
+
+    def blend_top(self, top, **kwargs):
+        # Returns the blended value of the _utility of only those top chunks matching
+        # kwargs with the highest activations, ties being broken in favor of those created
+        # first, or None if there are none, and a bound on its difference from the value
+        # blending all of them, as for _ArrayMemory.blend_all(). Only the chunks blended
+        # remain in the activation_history.
+        history = self._activation_history
+        start = len(history) if history is not None else 0
+        activations = list(self._activations(kwargs))
+        if not activations:
+            return None, None
+        order = sorted(range(len(activations)), key=lambda j: -activations[j][1])
+        blended = sorted(order[:top])
+        scale = max(activations[j][1] for j in blended)
+        weights = [ math.exp((activations[j][1] - scale) / self._temperature)
+                    for j in blended ]
+        total = sum(weights)
+        result = sum(w * activations[j][0]["_utility"]
+                     for w, j in zip(weights, blended)) / total
+        error = 0.0
+        if len(order) > top:
+            omitted = sum(math.exp(min((activations[j][1] - scale) / self._temperature, 700))
+                          for j in order[top:])
+            error = (omitted / (omitted + total)
+                     * max(abs(activations[j][0]["_utility"] - result) for j in order[top:]))
+        if history is not None:
+            records = history[start:]
+            del history[start:]
+            for w, j in zip(weights, blended):
+                records[j]["retrieval_probability"] = w / total
+                history.append(records[j])
+        return result, error
+
+    def evict(self, n):
+        # As for _ArrayMemory.evict(), removing the n chunks with the lowest base level
+        # activations at the time following the current one.
+        items = list(self.items())
+        n = min(n, len(items))
+        if n <= 0:
+            return 0
+        now = self._time + 1
+        activations = np.empty(len(items))
+        for j, (signature, chunk) in enumerate(items):
+            if self._exact_references:
+                activations[j] = self._approximate_base(chunk, now)
+                continue
+            r = self._chunk_references(chunk)
+            if self._optimized_learning:
+                activations[j] = (math.log(r / (1 - self._decay))
+                                  - self._decay * math.log(now - chunk._creation))
+            else:
+                activations[j] = math.log(np.sum((now - np.array(r, dtype=float))
+                                                 ** -self._decay))
+        for j in np.argsort(activations, kind="stable")[:n].tolist():
+            del self[items[j][0]]
+        self._clear_noise_cache()
+        return n
+
+    def _chunk_references(self, chunk):
+        # pyactup keeps a chunk's references in a NumPy array, which may be longer than
+        # the number of references, and keeps count of them separately.
+        n = chunk._reference_count
+        if self._optimized_learning:
+            return n
+        return chunk._references[:n].tolist()
+
+    def _approximate_base(self, chunk, now):
+        # Returns the base level activation of chunk at time now using the hybrid
+        # approximation, from only its most recent references and its creation time.
+        n = chunk._reference_count
+        k = self._exact_references
+        recent = now - np.asarray(chunk._references[max(n - k, 0):n], dtype=float)
+        if np.any(recent <= 0):
+            raise RuntimeError("Can't compute activation of a chunk at or before the time of its most recent reference")
+        result = np.sum(recent ** -self._decay)
+        if n > k:
+            result += _older_references(n - k, recent[0], now - chunk._creation,
+                                        self._decay)
+        return math.log(result)
+
+    _retrieval_threshold = None
+
+    # If not None, the only chunks considered when activating chunks, as set while
+    # blending a query whose matching chunks have already been found by match_all().
+    _candidates = None
+
+    class _Activations(pyactup.Memory._Activations):
+        # The same as pyactup's, except that which attributes are partially matched is
+        # decided by the Memory's own similarity functions, rather than only those of the
+        # process as a whole, that chunks whose activations are below the Memory's
+        # retrieval threshold, if any, are skipped, and that when using the hybrid
+        # approximation a chunk's base level activation is computed by
+        # _approximate_base(), and cached where pyactup would cache its own. Only the
+        # Memory's _candidates, if any, are considered.
+
+        def __iter__(self):
+            candidates = self._memory._candidates
+            self._chunks = iter(self._memory.values() if candidates is None else candidates)
+            return self
+
+        def __next__(self):
+            memory = self._memory
+            conditions = self._conditions
+            while True:
+                chunk = next(self._chunks)
+                if not conditions.keys() <= chunk.keys():
+                    continue
+                if memory._mismatch is None:
+                    exact = conditions.keys()
+                    partial = []
+                else:
+                    exact = []
+                    partial = []
+                    for c in conditions.keys():
+                        if memory._similarity_functions.get(c):
+                            partial.append(c)
+                        else:
+                            exact.append(c)
+                if not all(chunk[a] == conditions[a] for a in exact):
+                    continue
+                if (memory._exact_references
+                        and chunk._base_activation_time != memory._time):
+                    chunk._base_activation = memory._approximate_base(chunk, memory._time)
+                    chunk._base_activation_time = memory._time
+                activation = chunk._activation(True)
+                if memory._mismatch is None:
+                    mismatch = None
+                    total = activation
+                else:
+                    mismatch = (memory._mismatch
+                                * sum(memory._similarity(conditions[a], chunk[a], a) - 1
+                                      for a in partial))
+                    total = activation + mismatch
+                threshold = memory._retrieval_threshold
+                if threshold is not None and total < threshold:
+                    if memory._activation_history is not None:
+                        memory._activation_history.pop()
+                    continue
+                if memory._activation_history is not None:
+                    history = memory._activation_history[-1]
+                    if mismatch is not None:
+                        history["mismatch"] = mismatch
+                    history["activation"] = total
+                return (chunk, total)
+
+    def _make_noise(self, chunk):
+        if not self._noise:
+            return 0
+        cache = self._activation_noise_cache
+        if cache is not None:
+            result = cache.get(chunk._name)
+            if result is not None:
+                return result
+        result = self._noise * self._noise_pool.next()
+        if cache is not None:
+            cache[chunk._name] = result
+        return result
+
+
+class _ArrayMemory(_SimilarityFunctions, pyactup.Memory):
+    # A replacement for the pyactup.Memory used by a vectorized Agent. Instances are
+    # stored as columns of NumPy arrays instead of as pyactup Chunks, and the activations,
+    # retrieval probabilities and blended values for all the queries of a choose() are
+    # computed together, with a handful of vectorized operations. Only that part of the
+    # Memory API used by Agent is supported; the underlying dict is always empty, while the
+    # parameters (noise, decay, temperature, mismatch and so on) and their validation are
+    # simply those of pyactup.Memory.
+
+    _INITIAL_CAPACITY = 64
+
+    _name_counter = 0
+
+    _retrieval_threshold = None
+
+    # As for _Memory.
+    _exact_references = None
+
+    # The runs of an instance referenced only at time zero.
+    _CREATED = np.array([[0], [0], [1]])
+
+    # The number of references a memory makes before it begins merging them into runs;
+    # with fewer the sums over runs cost more than those over the references themselves,
+    # as in short episodes between resets.
+    _MERGING_MINIMUM = 2048
+
+    def __init__(self, rng=None, **kwargs):
+        self._size = 0
+        self._noise_pool = _NoisePool(_numpy_rng(rng))
+        self._init_similarity_functions()
+        super().__init__(**kwargs)
+
+    def __repr__(self):
+        return f"<_ArrayMemory {self._size}>"
+
+    def reset(self, preserve_prepopulated=False, optimized_learning=None):
+        optimized_learning, exact = _split_optimized_learning(optimized_learning)
+        if optimized_learning and self._decay >= 1:
+            raise RuntimeError(f"Optimized learning cannot be enabled if the decay, {self._decay}, is not less than 1")
+        if optimized_learning is not None:
+            # the references are recorded in the same way with and without the hybrid
+            # approximation
+            self._exact_references = exact
+        if (preserve_prepopulated and self._watermark is not None
+                and (optimized_learning is None
+                     or bool(optimized_learning) == self._optimized_learning)):
+            self._truncate(self._watermark)
+            self._time = 0
+            self._clear_noise_cache()
+            return
+        preserved = []
+        if preserve_prepopulated:
+            preserved = [(self._queries[i], self._outcome_values[i], self._names[i])
+                         for i in range(self._size)
+                         if self._counts[i] and self._creations[i] == 0]
+        self._time = 0
+        if optimized_learning is not None:
+            self._optimized_learning = bool(optimized_learning)
+        self._clear_instances()
+        for query, outcome, name in preserved:
+            self._cite(self._add_instance(query, outcome, name))
+        self._clear_noise_cache()
+
+    def _clear_instances(self):
+        n = _ArrayMemory._INITIAL_CAPACITY
+        self._size = 0
+        self._outcomes = np.empty(n, dtype=float)
+        self._outcome_values = []
+        self._creations = np.empty(n, dtype=int)
+        self._counts = np.zeros(n, dtype=int)
+        # The time of the most recent reference to each instance, or a later time if
+        # that reference has since been forgotten, bounding its base level activation.
+        # Only needed with a retrieval threshold or approximate blending, it is None until
+        # first made by _latest_references(), and only then kept up to date.
+        self._latest = None
+        # The references to each instance, unless using optimized learning, are recorded
+        # in the order they were made as runs, increasing arithmetic progressions of
+        # times, so that an instance referenced on every trial, or on every other, for
+        # example, adds to one run rather than adding a time of its own. Each is an array
+        # of three rows, of the times of runs' first and last references and of the steps
+        # between successive ones, one if there is only one, with a column for each run and
+        # room for more, the number of columns in use being in _run_counts. Until the
+        # memory has made _MERGING_MINIMUM references, though, every run is of a single
+        # reference, and base level activations are summed reference by reference, as
+        # merging them only pays once there are enough.
+        self._references = []
+        self._run_counts = np.zeros(n, dtype=int)
+        self._references_made = 0
+        self._merging = False
+        self._names = []
+        self._signatures = {}
+        # The query of each instance, a tuple of attribute name/value pairs as made from
+        # the dicts returned by Agent._canonicalize_choice.
+        self._queries = []
+        # The index maps each query to a list of the indices of the instances having it.
+        self._index = {}
+        # The least and greatest outcomes of the instances having each query, which may be
+        # wider than those of the instances remaining after some have been forgotten.
+        self._outcome_ranges = {}
+        # After fork() or adopt() the above are shared with other memories until _unshare() is
+        # called, before they are first changed. The arrays of references of the first
+        # _shared_size instances remain shared, and are copied individually as needed,
+        # their indices then being added to _copied_references.
+        self._shared = False
+        self._shared_size = 0
+        self._copied_references = set()
+        # The instances created at time zero are usually all added first, before any
+        # others. So long as they are, the watermark is the number of them, and
+        # resetting while preserving them need only truncate the columns to it. It is
+        # None if an instance created at time zero has been added after some other
+        # instance, or if one of them has been forgotten.
+        self._watermark = 0
+
+    def _truncate(self, n):
+        # Discards all but the first n instances, each of which is left as it was when
+        # first created at time zero, referenced only then. New columns are made, rather
+        # than the existing ones changed, as they may be shared with other memories.
+        capacity = max(_ArrayMemory._INITIAL_CAPACITY, 2 * n)
+        self._outcomes = np.resize(self._outcomes[:n], capacity)
+        self._creations = np.zeros(capacity, dtype=int)
+        self._counts = np.zeros(capacity, dtype=int)
+        self._counts[:n] = 1
+        self._latest = None
+        self._outcome_values = self._outcome_values[:n]
+        self._queries = self._queries[:n]
+        self._names = self._names[:n]
+        # Each of these instances is referenced only at time zero, which all share a
+        # single record of, to be copied if reinforced.
+        self._references = [ _ArrayMemory._CREATED ] * n
+        self._run_counts = np.zeros(capacity, dtype=int)
+        self._run_counts[:n] = 1
+        self._references_made = n
+        self._merging = False
+        self._rebuild_maps()
+        self._size = n
+        self._shared = False
+        self._shared_size = n
+        self._copied_references = set()
+
+    def _rebuild_maps(self):
+        # Remakes the signatures, index and outcome ranges from the queries and outcome
+        # values.
+        self._signatures = dict(zip(zip(self._queries, self._outcome_values),
+                                    range(len(self._queries))))
+        self._index = {}
+        for i, query in enumerate(self._queries):
+            self._index.setdefault(query, []).append(i)
+        outcomes = self._outcomes[:len(self._queries)]
+        self._outcome_ranges = { query: (outcomes[ids].min().item(), outcomes[ids].max().item())
+                                 for query, ids in self._index.items() }
+
+    def _find_watermark(self):
+        # Returns the number of leading instances created at time zero, or None if
+        # there are others created then, or if the reference at time zero of one of them
+        # has been forgotten.
+        created = self._creations[:self._size]
+        later = np.flatnonzero(created != 0)
+        w = int(later[0]) if later.size else self._size
+        if np.any(created[w:] == 0):
+            return None
+        if not self._optimized_learning and any(r[0, 0] for r in self._references[:w]):
+            return None
+        return w
+
+    def instance_count(self):
+        return int(np.count_nonzero(self._counts[:self._size]))
+
+    def evict(self, n):
+        # Removes the n instances with the lowest base level activations at the time
+        # following the current one, ties being broken in favor of retaining the more
+        # recently created, and returns the number removed. The remaining instances are
+        # compacted into new columns, so that the space used by those removed is freed.
+        live = np.flatnonzero(self._counts[:self._size])
+        n = min(n, live.size)
+        if n <= 0:
+            return 0
+        saved = self._time
+        try:
+            self._time = saved + 1
+            activations = self._base_activations(live)
+        finally:
+            self._time = saved
+        doomed = np.argsort(activations, kind="stable")[:n]
+        keep = np.delete(live, doomed).tolist()
+        capacity = max(_ArrayMemory._INITIAL_CAPACITY, 2 * len(keep))
+        self._outcomes = np.resize(self._outcomes[keep], capacity)
+        self._creations = np.resize(self._creations[keep], capacity)
+        counts = self._counts[keep]
+        self._counts = np.zeros(capacity, dtype=int)
+        self._counts[:len(keep)] = counts
+        if self._latest is not None:
+            self._latest = np.resize(self._latest[keep], capacity)
+        self._outcome_values = [ self._outcome_values[i] for i in keep ]
+        self._queries = [ self._queries[i] for i in keep ]
+        self._names = [ self._names[i] for i in keep ]
+        self._references = [ self._own_references(i) for i in keep ]
+        run_counts = self._run_counts[keep]
+        self._run_counts = np.zeros(capacity, dtype=int)
+        self._run_counts[:len(keep)] = run_counts
+        self._rebuild_maps()
+        self._size = len(keep)
+        self._shared = False
+        self._shared_size = 0
+        self._copied_references = set()
+        self._watermark = self._find_watermark()
+        self._clear_noise_cache()
+        return n
+
+    def fork(self, rng):
+        # Returns a copy of this Memory, drawing its noise from rng, that initially shares
+        # the columns holding the instances with this one; it and this one each copy them
+        # before first changing them.
+        result = copy.copy(self)
+        result._noise_pool = _NoisePool(_numpy_rng(rng))
+        result._own_similarity_functions = dict(self._own_similarity_functions)
+        result._own_similarity_cache = {}
+        result._similarity_functions = ChainMap(result._own_similarity_functions,
+                                                pyactup.Memory._similarity_functions)
+        result.adopt(self)
+        return result
+
+    _COLUMNS = ("_outcomes", "_creations", "_counts", "_latest", "_outcome_values",
+                "_queries", "_names", "_references", "_run_counts", "_signatures",
+                "_index", "_outcome_ranges")
+
+    def adopt(self, other):
+        # Replaces the instances of this Memory with those of other, the columns holding
+        # them being shared until either this Memory or other changes them.
+        for name in _ArrayMemory._COLUMNS:
+            setattr(self, name, getattr(other, name))
+        self._size = other._size
+        self._watermark = other._watermark
+        self._references_made = other._references_made
+        self._merging = other._merging
+        for m in (self, other):
+            m._shared = True
+            m._shared_size = m._size
+            m._copied_references = set()
+
+    def _unshare(self):
+        self._outcomes = self._outcomes.copy()
+        self._creations = self._creations.copy()
+        self._counts = self._counts.copy()
+        if self._latest is not None:
+            self._latest = self._latest.copy()
+        self._outcome_values = list(self._outcome_values)
+        self._queries = list(self._queries)
+        self._names = list(self._names)
+        self._references = list(self._references)
+        self._run_counts = self._run_counts.copy()
+        self._signatures = dict(self._signatures)
+        self._index = { query: list(ids) for query, ids in self._index.items() }
+        self._outcome_ranges = dict(self._outcome_ranges)
+        self._shared = False
+
+    def _own_references(self, i):
+        # Returns the array of the runs of references of instance i, copying it first if
+        # it is shared with another memory.
+        refs = self._references[i]
+        if i < self._shared_size and i not in self._copied_references:
+            refs = refs.copy()
+            self._references[i] = refs
+            self._copied_references.add(i)
+        return refs
+
+    def _add_instance(self, query, outcome, name=None):
+        if self._shared:
+            self._unshare()
+        i = self._size
+        if i >= self._outcomes.size:
+            n = 2 * self._outcomes.size
+            self._outcomes = np.resize(self._outcomes, n)
+            self._creations = np.resize(self._creations, n)
+            self._counts = np.resize(self._counts, n)
+            if self._latest is not None:
+                self._latest = np.resize(self._latest, n)
+            self._run_counts = np.resize(self._run_counts, n)
+        self._outcomes[i] = outcome
+        self._outcome_values.append(outcome)
+        self._creations[i] = self._time
+        self._counts[i] = 0
+        if self._latest is not None:
+            self._latest[i] = self._time
+        self._queries.append(query)
+        self._references.append(np.empty((3, 1), dtype=int))
+        self._run_counts[i] = 0
+        if name is None:
+            name = f"{_ArrayMemory._name_counter:04d}"
+            _ArrayMemory._name_counter += 1
+        self._names.append(name)
+        self._signatures[(query, outcome)] = i
+        self._index.setdefault(query, []).append(i)
+        bounds = self._outcome_ranges.get(query)
+        if bounds is None:
+            self._outcome_ranges[query] = (outcome, outcome)
+        elif not bounds[0] <= outcome <= bounds[1]:
+            self._outcome_ranges[query] = (min(bounds[0], outcome), max(bounds[1], outcome))
+        self._size += 1
+        if self._time == 0:
+            self._watermark = i + 1 if self._watermark == i else None
+        return i
+
+    def _cite(self, i):
+        if self._shared:
+            self._unshare()
+        n = self._counts[i]
+        if not self._optimized_learning:
+            self._add_reference(i)
+        if self._latest is not None and self._time > self._latest[i]:
+            self._latest[i] = self._time
+        self._counts[i] = n + 1
+
+    def _add_reference(self, i):
+        # Records a reference at the current time to instance i, extending its last run if
+        # merging and the time follows on from it, and otherwise starting a new one. A run
+        # of a single reference is only extended by one close enough to it for the sums of
+        # the run to be tabulated by _DecayTables.
+        if not self._merging and self._references_made >= _ArrayMemory._MERGING_MINIMUM:
+            self._merge_references()
+        runs = self._own_references(i)
+        r = self._run_counts[i]
+        now = self._time
+        if r and self._merging:
+            first, last, step = runs[:, r - 1].tolist()
+            if (now == last + step
+                    or first == last and 0 < now - first <= _DecayTables._MAXIMUM_STRIDE):
+                runs[1:, r - 1] = (now, now - last)
+                return
+        if r >= runs.shape[1]:
+            runs = np.concatenate((runs, np.empty_like(runs)), axis=1)
+            self._references[i] = runs
+        runs[:, r] = (now, now, 1)
+        self._run_counts[i] = r + 1
+        self._references_made += 1
+
+    def _merge_references(self):
+        # Merges the references of every instance into runs, as they will be from now on.
+        for i in np.flatnonzero(self._run_counts[:self._size] > 1).tolist():
+            self._references[i], self._run_counts[i] = (
+                _ArrayMemory._runs_of(self._reference_times(i).tolist()))
+            self._copied_references.add(i)
+        self._merging = True
+
+    @staticmethod
+    def _run_lengths(firsts, lasts, steps):
+        # Returns an array of the numbers of references in the runs described.
+        return (lasts - firsts) // steps + 1
+
+    def _reference_times(self, i):
+        # Returns an array of the times of the references to instance i, in the order in
+        # which they were made, which should not be modified in place.
+        if not self._merging:
+            # every run is of a single reference, at its first time
+            return self._references[i][0, :self._run_counts[i]]
+        firsts, lasts, steps = self._references[i][:, :self._run_counts[i]]
+        lengths = _ArrayMemory._run_lengths(firsts, lasts, steps)
+        offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return (np.repeat(firsts, lengths)
+                + (np.arange(self._counts[i]) - offsets) * np.repeat(steps, lengths))
+
+    @staticmethod
+    def _runs_of(times, merge=True):
+        # Returns an array of the runs into which _add_reference() compresses references
+        # made at the given times, in order, with room for at least one, and the number
+        # of them; if merge is false each is a run of its own.
+        runs = []
+        for t in times:
+            if merge and runs:
+                run = runs[-1]
+                if (t == run[1] + run[2]
+                        or run[0] == run[1] and 0 < t - run[0] <= _DecayTables._MAXIMUM_STRIDE):
+                    run[1:] = (t, t - run[1])
+                    continue
+            runs.append([t, t, 1])
+        result = np.zeros((3, max(len(runs), 1)), dtype=int)
+        result[:, :len(runs)] = np.reshape(runs, (-1, 3)).T
+        return result, len(runs)
+
+    @staticmethod
+    def _split(kwargs):
+        kwargs = dict(kwargs)
+        try:
+            outcome = kwargs.pop("_utility")
+        except KeyError:
+            raise ValueError("vectorized memories can only learn instances with a _utility")
+        return tuple(kwargs.items()), outcome
+
+    def learn(self, advance=None, **kwargs):
+        query, outcome = _ArrayMemory._split(kwargs)
+        i = self._signatures.get((query, outcome))
+        created = i is None
+        if created:
+            i = self._add_instance(query, outcome)
+        self._cite(i)
+        self._advance(advance, self._learning_time_increment)
+        return created
+
+    def forget(self, when, **kwargs):
+        query, outcome = _ArrayMemory._split(kwargs)
+        i = self._signatures.get((query, outcome))
+        if i is None:
+            return False
+        if self._shared:
+            self._unshare()
+        if self._watermark is not None and i < self._watermark:
+            self._watermark = None
+        n = self._counts[i]
+        if not self._optimized_learning:
+            times = self._reference_times(i)
+            found = np.flatnonzero(times == when)
+            if not found.size:
+                return False
+            self._references[i], self._run_counts[i] = (
+                _ArrayMemory._runs_of(np.delete(times, found[0]).tolist(), self._merging))
+            self._copied_references.add(i)
+        elif when < self._creations[i]:
+            return False
+        elif when == self._creations[i] and n > 1:
+            raise RuntimeError("Can't meaningfully forget a chunk at its creation time with optimized learning")
+        self._counts[i] = n - 1
+        if n == 1:
+            del self._signatures[(query, outcome)]
+            self._index[query].remove(i)
+        return True
+
+    def instance_columns(self, attributes, chunk_size):
+        # Yields, for successive chunks of at most chunk_size instances, in the order in
+        # which they were created, a dict mapping each of the attributes, "_utility",
+        # "created" and "occurrences" to a sequence of the values of those instances,
+        # taken directly from the columns in which they are stored.
+        live = np.flatnonzero(self._counts[:self._size])
+        if not live.size:
+            return
+        # all the queries of an Agent have the same attributes, in the same order
+        names = [ name for name, value in self._queries[live[0]] ]
+        positions = [ names.index(a) for a in attributes ]
+        for start in range(0, live.size, chunk_size):
+            ids = live[start:start + chunk_size]
+            queries = [ self._queries[i] for i in ids.tolist() ]
+            result = { a: [ q[p][1] for q in queries ] for a, p in zip(attributes, positions) }
+            result["_utility"] = [ self._outcome_values[i] for i in ids.tolist() ]
+            result["created"] = self._creations[ids]
+            if self._optimized_learning:
+                result["occurrences"] = self._counts[ids]
+            else:
+                result["occurrences"] = [ self._reference_times(i).tolist()
+                                          for i in ids.tolist() ]
+            yield result
+
+    def snapshot(self, keys):
+        # As for _Memory.snapshot(), but taken directly from the columns.
+        live = np.flatnonzero(self._counts[:self._size])
+        counts = self._counts[live]
+        if self._optimized_learning or not live.size:
+            references = np.empty(0, dtype=int)
+        else:
+            references = np.concatenate([ self._reference_times(i) for i in live.tolist() ])
+        return ([ self._queries[i] for i in live.tolist() ],
+                [ self._outcome_values[i] for i in live.tolist() ],
+                self._creations[live],
+                counts,
+                references)
+
+    def restore(self, queries, outcomes, created, counts, references):
+        # Replaces the instances with those described by the values returned by snapshot().
+        self._clear_instances()
+        n = len(queries)
+        capacity = max(n, _ArrayMemory._INITIAL_CAPACITY)
+        self._outcomes = np.resize(np.asarray(outcomes, dtype=float), capacity)
+        self._creations = np.resize(np.asarray(created, dtype=int), capacity)
+        self._counts = np.zeros(capacity, dtype=int)
+        self._counts[:n] = counts
+        self._outcome_values = list(outcomes)
+        self._queries = list(queries)
+        self._run_counts = np.zeros(capacity, dtype=int)
+        if self._optimized_learning:
+            self._references = [ np.empty((3, 1), dtype=int) for i in range(n) ]
+        else:
+            references = np.array(references, dtype=int)
+            ends = np.cumsum(counts).tolist()
+            self._references_made = references.size
+            self._merging = references.size >= _ArrayMemory._MERGING_MINIMUM
+            self._references = []
+            for j, (start, end) in enumerate(zip([0] + ends[:-1], ends)):
+                runs, self._run_counts[j] = _ArrayMemory._runs_of(references[start:end].tolist(),
+                                                                  self._merging)
+                self._references.append(runs)
+        first = _ArrayMemory._name_counter
+        _ArrayMemory._name_counter += n
+        self._names = [ f"{i:04d}" for i in range(first, first + n) ]
+        self._rebuild_maps()
+        self._size = n
+        self._watermark = self._find_watermark()
+
+    @pyactup.Memory.decay.setter
+    def decay(self, value):
+        pyactup.Memory.decay.fset(self, value)
+        self._decay_tables = _DecayTables(self._decay)
+
+    def _base_activations(self, ids):
+        # The base level activations of the instances whose indices are in ids. Once
+        # merging references into runs the decayed references are summed a run at a time,
+        # by _run_sums(), and otherwise a reference at a time. With the hybrid
+        # approximation only the most recent references to each are summed exactly, the
+        # rest being approximated by _older_references().
+        now = self._time
+        counts = self._counts[ids]
+        if self._optimized_learning:
+            ages = now - self._creations[ids]
+            if np.any(ages <= 0):
+                raise RuntimeError("Can't compute activation of a chunk at or before the time it was created")
+            if isinstance(now, numbers.Integral):
+                decayed = self._decay_tables.logs(now)[ages]
+            else:
+                decayed = -self._decay * np.log(ages)
+            return np.log(counts) - math.log(1 - self._decay) + decayed
+        run_counts = self._run_counts[ids]
+        offsets = np.zeros(len(ids), dtype=int)
+        np.cumsum(run_counts[:-1], out=offsets[1:])
+        k = self._exact_references
+        if k is None and not self._merging:
+            # every run is of a single reference, at its first time
+            ages = now - np.concatenate([ self._references[i][0, :r]
+                                          for i, r in zip(ids, run_counts) ])
+            if np.any(ages <= 0):
+                raise RuntimeError("Can't compute activation of a chunk at or before the time of its most recent reference")
+            if isinstance(now, numbers.Integral):
+                decayed = self._decay_tables.powers(now)[ages]
+            else:
+                decayed = ages ** -self._decay
+            return np.log(np.add.reduceat(decayed, offsets))
+        firsts, lasts, steps = np.concatenate([ self._references[i][:, :r]
+                                                for i, r in zip(ids, run_counts) ], axis=1)
+        if k is None:
+            return np.log(np.add.reduceat(self._run_sums(firsts, lasts, steps), offsets))
+        # only the parts of the runs holding the k most recent references to each instance
+        # are summed, the references before them being skipped
+        lengths = _ArrayMemory._run_lengths(firsts, lasts, steps)
+        owners = np.repeat(np.arange(len(ids)), run_counts)
+        positions = np.cumsum(lengths) - lengths
+        positions -= positions[offsets][owners]
+        skipped = np.clip(np.maximum(counts - k, 0)[owners] - positions, 0, lengths)
+        used = skipped < lengths
+        firsts = (firsts + skipped * steps)[used]
+        owners = owners[used]
+        starts = np.flatnonzero(np.diff(owners, prepend=-1))
+        sums = np.add.reduceat(self._run_sums(firsts, lasts[used], steps[used]), starts)
+        older = counts - np.minimum(counts, k)
+        approximated = np.flatnonzero(older)
+        if approximated.size:
+            # the first run summed for each instance starts at its kth most recent reference
+            sums[approximated] += _older_references(older[approximated],
+                                                    now - firsts[starts[approximated]],
+                                                    now - self._creations[ids[approximated]],
+                                                    self._decay)
+        return np.log(sums)
+
+    def _run_sums(self, firsts, lasts, steps):
+        # Returns an array of the sums of age^-decay over the references of each of the
+        # runs described, as differences of cumulative sums kept by _DecayTables, or, if
+        # time is not an integer, term by term.
+        now = self._time
+        if now <= lasts.max():
+            raise RuntimeError("Can't compute activation of a chunk at or before the time of its most recent reference")
+        if not isinstance(now, numbers.Integral):
+            return self._expanded_sums(firsts, lasts, steps)
+        sums, width = self._decay_tables.sums(now - int(firsts.min()))
+        # the index in sums of the entry for age zero with each run's step, plus the
+        # current time, so that subtracting a time gives the index of the entry for its
+        # age; the sum over a run is that to its oldest age less that to one step before
+        # its youngest
+        rows = steps * width + (now + _DecayTables._MAXIMUM_STRIDE - width)
+        return sums[rows - firsts] - sums[rows - lasts - steps]
+
+    def _expanded_sums(self, firsts, lasts, steps):
+        # Returns an array of the sums of age^-decay over the references of each of the
+        # runs described, computed term by term.
+        lengths = _ArrayMemory._run_lengths(firsts, lasts, steps)
+        offsets = np.zeros(len(lengths), dtype=int)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        positions = np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+        ages = self._time - (np.repeat(firsts, lengths) + positions * np.repeat(steps, lengths))
+        return np.add.reduceat(ages ** -self._decay, offsets)
+
+    def _matches(self, query):
+        # Returns an array of the indices of the instances matching query, in the order
+        # in which they were created, and an array of their mismatch penalties, or None
+        # if not partially matching. Exact matches are simply looked up in the index;
+        # partial matches compare the query with all the distinct stored queries at once,
+        # attribute by attribute.
+        if self._mismatch is None:
+            return np.array(self._index.get(query, ()), dtype=int), None
+        others = [ other for other, instances in self._index.items() if instances ]
+        matching = np.ones(len(others), dtype=bool)
+        penalties = np.zeros(len(others), dtype=float)
+        for position, (a, v) in enumerate(query):
+            values = [ other[position][1] for other in others ]
+            function = self._similarity_functions.get(a)
+            if function:
+                penalties += self._similarities(v, values, a, function) - 1
+            else:
+                matching &= np.fromiter((w == v for w in values), dtype=bool, count=len(values))
+        ids = []
+        instance_penalties = []
+        for other, penalty in zip(compress(others, matching), penalties[matching]):
+            instances = self._index[other]
+            ids.extend(instances)
+            instance_penalties.extend([self._mismatch * penalty] * len(instances))
+        ids = np.array(ids, dtype=int)
+        order = np.argsort(ids, kind="stable")
+        return ids[order], np.array(instance_penalties, dtype=float)[order]
+
+    def _similarities(self, value, values, attribute, function):
+        # Returns an array of the similarities of value to each of values, with the same
+        # conventions as pyactup's Memory._similarity. If the similarity function has a
+        # vectorized version, as do those provided by PyIBL, and the values are all real
+        # numbers, it is called once for all of them, and values outside the allowed range
+        # are counted and warned about only once.
+        vectorized = getattr(function, "vectorized", None)
+        if vectorized and isinstance(value, numbers.Real):
+            try:
+                array = np.asarray(values, dtype=float)
+            except (TypeError, ValueError):
+                vectorized = None
+        if not vectorized or not isinstance(value, numbers.Real):
+            return np.array([ self._similarity(value, w, attribute) for w in values ],
+                            dtype=float)
+        result = np.asarray(vectorized(value, array), dtype=float)
+        low = pyactup.Memory._minimum_similarity
+        high = pyactup.Memory._maximum_similarity
+        clamped = np.count_nonzero((result < low) | (result > high))
+        if clamped:
+            warn(f"{clamped} similarity values were outside the allowed range, {low} to {high}, and have been replaced by the nearest value in that range")
+            result = np.clip(result, low, high)
+        if pyactup.Memory._use_actr_similarity:
+            result = result + 1
+        return np.where(array == value, 1.0, result)
+
+    def _bounds(self, ids):
+        # Returns arrays of lower and upper bounds on the base level activations of the
+        # instances whose indices are in ids, computed from their numbers of references
+        # and the times of their creation and of their most recent references. The sum of
+        # the decayed references is no greater than were they all at the time of the most
+        # recent, and no less than either that most recent alone or were they all at the
+        # time of creation.
+        now = self._time
+        ages = now - self._latest_references()[ids]
+        if np.any(ages <= 0):
+            raise RuntimeError("Can't compute activation of a chunk at or before the time of its most recent reference")
+        created = now - self._creations[ids]
+        if isinstance(now, numbers.Integral):
+            logs = self._decay_tables.logs(now)
+            latest = logs[ages]
+            earliest = logs[created]
+        else:
+            latest = -self._decay * np.log(ages)
+            earliest = -self._decay * np.log(created)
+        counts = np.log(self._counts[ids])
+        return np.maximum(latest, counts + earliest), counts + latest
+
+    def _latest_references(self):
+        # Returns the array of the times of the most recent references to the instances,
+        # making it from their runs if it is not being kept.
+        if self._latest is None:
+            latest = self._creations.copy()
+            for i in np.flatnonzero(self._run_counts[:self._size]).tolist():
+                latest[i] = self._references[i][1, self._run_counts[i] - 1]
+            self._latest = latest
+        return self._latest
+
+    def _noise_for(self, n):
+        # Returns an array of n samples of activation noise.
+        if self._noise:
+            return self._noise * self._noise_pool.take(n)
+        return np.zeros(n)
+
+    def _activate(self, ids, top=None):
+        # Returns arrays of the base level activations and activation noise of the
+        # instances whose indices are in ids, as computed by _initial_base().
+        noise = self._noise_for(len(ids))
+        return self._initial_base(ids, noise, top), noise
+
+    def _initial_base(self, ids, noise, top):
+        # Returns an array of the base level activations of the instances whose indices
+        # are in ids, given their noise. If there is a retrieval threshold or only the top
+        # instances are to be blended they are computed only as they may be needed, those
+        # of the others being NaN: with a threshold only those of instances that might
+        # exceed it, even though mismatch penalties can only lower their activations, and
+        # with top none, those needed being decided by _blend_query() for each query.
+        threshold = self._retrieval_threshold
+        if self._optimized_learning or (threshold is None and top is None):
+            return self._base_activations(ids)
+        base = np.full(len(ids), np.nan)
+        if top is not None:
+            return base
+        possible = self._bounds(ids)[1] + noise >= threshold
+        if np.any(possible):
+            base[possible] = self._base_activations(ids[possible])
+        return base
+
+    def outcome_range(self, query):
+        # Returns the least and greatest outcomes of the instances learned for query, a
+        # dict of attribute values, or None if there have been none.
+        return self._outcome_ranges.get(tuple(query.items()))
+
+    def blend_all(self, queries, history=False, top=None, prune=None):
+        # Yields for each of the queries, a dict of attribute values, the blended value of
+        # the _utility of the instances matching it, or None if there are none, if history
+        # is true, a list of dicts describing the computation in the same form as
+        # pyactup's activation_history, or, if history is "columns", a dict of arrays of
+        # the same values in the form recorded by a DetailsRecorder, and, if top is not
+        # None, a bound on the error of the blended value, otherwise None. Only the
+        # instances matching a query are activated, and the noise of any given instance is
+        # the same for all of the queries. Instances whose activations are below the
+        # retrieval threshold, if any, are excluded, and if top is not None only the top
+        # of the remaining instances with the highest activations are blended; the base
+        # level activations of those that cannot be among them, by the bounds on them, are
+        # not computed. In the commonest case, matching exactly with neither a threshold
+        # nor a top, all the queries are blended together by _blend_together(), which
+        # costs less than computing the blended value of even one query alone, so nothing
+        # is then pruned. Otherwise, if prune is not None see _blend_pruned(), and if it is
+        # None instances added while this is being iterated, as for a default utility,
+        # are included in the blending of subsequent queries.
+        if (self._mismatch is None and self._retrieval_threshold is None and top is None
+                and not history):
+            keys = [ tuple(q.items()) for q in queries ]
+            if len(set(keys)) == len(keys):
+                yield from self._blend_together([ self._index.get(k, ()) for k in keys ])
+                return
+        if prune is not None and len(queries) > 1:
+            yield from self._blend_pruned(queries, top, prune)
+            return
+        base = np.empty(self._size)
+        noise = np.empty(self._size)
+        activated = np.zeros(self._size, dtype=bool)
+        for q in queries:
+            if self._size > activated.size:
+                base = np.resize(base, self._size)
+                noise = np.resize(noise, self._size)
+                activated = np.concatenate((activated,
+                                            np.zeros(self._size - activated.size, dtype=bool)))
+            ids, mismatch = self._matches(tuple(q.items()))
+            if not ids.size:
+                yield None, ([] if history else None), None
+                continue
+            fresh = ids[~activated[ids]]
+            if fresh.size:
+                base[fresh], noise[fresh] = self._activate(fresh, top)
+                activated[fresh] = True
+            yield self._blend_query(ids, mismatch, base, noise, history, top)
+
+    def _blend_together(self, matches):
+        # As blend_all(), without history, when matching exactly, and with neither a
+        # retrieval threshold nor a top, for queries matching the lists of instance indices
+        # in matches, no instance matching more than one of them. All the instances are
+        # activated at once, their noise being drawn in the order it would be were the
+        # queries blended in turn, and the sums over each query's instances are taken by
+        # reducing over the segment of the arrays holding them.
+        lengths = np.fromiter(map(len, matches), dtype=int, count=len(matches))
+        present = np.flatnonzero(lengths)
+        if not present.size:
+            return [ (None, None, None) ] * len(matches)
+        sizes = lengths[present]
+        ids = np.fromiter(chain.from_iterable(matches), dtype=int, count=sizes.sum())
+        activations = self._base_activations(ids) + self._noise_for(ids.size)
+        starts = np.cumsum(sizes) - sizes
+        scales = np.repeat(np.maximum.reduceat(activations, starts), sizes)
+        weights = np.exp((activations - scales) / self._temperature)
+        probabilities = weights / np.repeat(np.add.reduceat(weights, starts), sizes)
+        values = np.add.reduceat(probabilities * self._outcomes[ids], starts).tolist()
+        results = [ (None, None, None) ] * len(matches)
+        for j, value in zip(present.tolist(), values):
+            results[j] = (value, None, None)
+        return results
+
+    def _blend_pruned(self, queries, top, prune):
+        # As blend_all(), without history, when not partially matching, so that each
+        # instance matches at most one of the queries. The queries are blended in
+        # decreasing order of the greatest outcomes of their instances, and a query for
+        # which both that and prune, the greatest other value it might be given, such as
+        # a default utility, or -inf, are less than a blended value already computed is
+        # skipped, _DOMINATED being yielded in place of its blended value. The noise of all
+        # the instances is drawn first, in the order in which it would be were the queries
+        # blended in order, so that it is the same as were none skipped.
+        matches = [ self._matches(tuple(q.items()))[0] for q in queries ]
+        noise = np.empty(self._size)
+        for ids in matches:
+            noise[ids] = self._noise_for(len(ids))
+        base = np.empty(self._size)
+        def greatest_outcome(j):
+            return self.outcome_range(queries[j])[1] if matches[j].size else math.inf
+        order = sorted(range(len(queries)), key=lambda j: -greatest_outcome(j))
+        results = [None] * len(queries)
+        greatest = None
+        for j in order:
+            ids = matches[j]
+            if not ids.size:
+                results[j] = (None, None, None)
+            elif greatest is not None and max(greatest_outcome(j), prune) < greatest:
+                results[j] = (_DOMINATED, None, None)
+            else:
+                base[ids] = self._initial_base(ids, noise[ids], top)
+                results[j] = self._blend_query(ids, None, base, noise, False, top)
+                if results[j][0] is not None and (greatest is None or results[j][0] > greatest):
+                    greatest = results[j][0]
+        yield from results
+
+    def _blend_query(self, ids, mismatch, base, noise, history, top):
+        # Returns the blended value, history and error, as yielded by blend_all(), of a
+        # query matching the instances whose indices are in ids, with the given mismatch
+        # penalties, or None, and whose noise, and base level activations, those not yet
+        # computed being NaN, are in base and noise.
+        threshold = self._retrieval_threshold
+        penalties = 0 if mismatch is None else mismatch
+        upper = None
+        if top is not None and ids.size > top and not self._optimized_learning:
+            lower, upper = self._bounds(ids)
+            known = ~np.isnan(base[ids])
+            lower[known] = upper[known] = base[ids[known]]
+            lower += noise[ids] + penalties
+            upper += noise[ids] + penalties
+            if threshold is not None:
+                lower[lower < threshold] = -np.inf
+                upper[upper < threshold] = -np.inf
+            least = -np.partition(-lower, top - 1)[top - 1]
+            needed = ~known & (upper >= least) & (upper > -np.inf)
+            if np.any(needed):
+                base[ids[needed]] = self._base_activations(ids[needed])
+        elif top is not None:
+            missing = ids[np.isnan(base[ids])]
+            if missing.size:
+                base[missing] = self._base_activations(missing)
+        activations = base[ids] + noise[ids] + penalties
+        if threshold is not None or top is not None:
+            ids, activations, mismatch, omitted, bounds = self._select(ids, activations,
+                                                                       mismatch, upper, top)
+            if not ids.size:
+                return None, ([] if history else None), None
+        scale = activations.max()
+        weights = np.exp((activations - scale) / self._temperature)
+        probabilities = weights / weights.sum()
+        outcomes = self._outcomes[ids]
+        result = float(np.dot(probabilities, outcomes))
+        error = None
+        if top is not None:
+            # The exact blended value differs from result by the omitted instances'
+            # share of the total weight times the weighted mean deviation of their
+            # outcomes from result; that share only grows with their weights.
+            error = 0.0
+            if bounds.size:
+                with np.errstate(over="ignore", divide="ignore"):
+                    omitted_weight = np.exp((bounds - scale) / self._temperature).sum()
+                    share = 1 / (1 + weights.sum() / omitted_weight)
+                error = float(share * np.abs(self._outcomes[omitted] - result).max())
+        if not history:
+            return result, None, error
+        if history == "columns":
+            return result, {"name": [ self._names[i] for i in ids ],
+                           "creation_time": self._creations[ids],
+                           "reference_count": self._counts[ids],
+                           "utility": outcomes,
+                           "base_activation": base[ids],
+                           "activation_noise": noise[ids],
+                           "mismatch": mismatch,
+                           "activation": activations,
+                           "retrieval_probability": probabilities}, error
+        h = []
+        for j, i in enumerate(ids):
+            n = self._counts[i]
+            d = {"name": self._names[i],
+                 "creation_time": self._creations[i].item(),
+                 "attributes": (("_utility", self._outcome_values[i]),
+                                *self._queries[i]),
+                 "references": (n.item() if self._optimized_learning
+                                else tuple(self._reference_times(i).tolist())),
+                 "base_activation": base[i].item(),
+                 "activation_noise": noise[i].item()}
+            if mismatch is not None:
+                d["mismatch"] = mismatch[j].item()
+            d["activation"] = activations[j].item()
+            d["retrieval_probability"] = probabilities[j].item()
+            h.append(d)
+        return result, h, error
+
+    def _select(self, ids, activations, mismatch, upper, top):
+        # Returns the indices, activations and mismatch penalties, or None, of those of the
+        # instances whose indices are in ids, with the given activations, NaN if not
+        # computed, that are retrieved and among the top, if any, and the indices of those
+        # retrieved, or possibly retrieved, but not blended, and bounds on their
+        # activations, upper, if not None, being bounds on those not computed.
+        threshold = self._retrieval_threshold
+        # NaN activations, not computed, are neither retrieved nor blended
+        retrieved = ~np.isnan(activations)
+        if threshold is not None:
+            retrieved[retrieved] = activations[retrieved] >= threshold
+        blended = retrieved
+        if top is not None and np.count_nonzero(retrieved) > top:
+            candidates = np.flatnonzero(retrieved)
+            best = np.argsort(-activations[candidates], kind="stable")[:top]
+            blended = np.zeros(ids.size, dtype=bool)
+            blended[np.sort(candidates[best])] = True
+        if upper is None:
+            omitted = retrieved & ~blended
+            bounds = activations[omitted]
+        else:
+            omitted = ~blended & (np.isnan(activations) | retrieved) & (upper > -np.inf)
+            bounds = np.where(np.isnan(activations), upper, activations)[omitted]
+        return (ids[blended], activations[blended],
+                None if mismatch is None else mismatch[blended],
+                ids[omitted], bounds)
+
+    def blend(self, outcome_attribute, advance=None, **kwargs):
+        if outcome_attribute != "_utility":
+            raise ValueError("vectorized memories can only blend the _utility")
+        old = self._advance(advance, self._retrieval_time_increment)
+        try:
+            result, history, error = next(self.blend_all([kwargs],
+                                                         self._activation_history is not None))
+            if history:
+                self._activation_history.extend(history)
+            if result is not None:
+                old = None
+            return result
+        finally:
+            if old is not None:
+                self._time = old
+
+
+class _DecayTables:
+    # Arrays, indexed by integer ages, of age^-decay and of -decay*ln(age), and of
+    # cumulative sums of the former. Since time in PyIBL is always an integer these replace
+    # the power and logarithm computations of base level activation by lookups. The tables
+    # grow, by doubling, as time advances; they are specific to one decay, and are simply
+    # replaced should that change.
+
+    _MINIMUM_SIZE = 1024
+
+    # The greatest step between the references of a run for which cumulative sums are
+    # kept; as each step needs a table as long as that of the powers, references further
+    # apart than this are not compressed into runs.
+    _MAXIMUM_STRIDE = 4
+
+    def __init__(self, decay):
+        self._decay = decay
+        self._powers = None
+        self._logs = None
+        self._sums = None
+
+    def _ensure(self, age):
+        if self._powers is None or age >= self._powers.size:
+            ages = np.arange(max(2 * age, _DecayTables._MINIMUM_SIZE), dtype=float)
+            with np.errstate(divide="ignore"):
+                self._powers = ages ** -self._decay
+                self._logs = -self._decay * np.log(ages)
+            self._sums = None
+
+    def powers(self, age):
+        # Returns the table of age^-decay, long enough to be indexed by age.
+        self._ensure(age)
+        return self._powers
+
+    def logs(self, age):
+        # Returns the table of -decay*ln(age), long enough to be indexed by age.
+        self._ensure(age)
+        return self._logs
+
+    def sums(self, age):
+        # Returns a table of the sums of a^-decay over a, a - stride, a - 2*stride and so
+        # on, while positive, and the width of its rows. It is flattened from rows for each
+        # stride from one to _MAXIMUM_STRIDE, each indexed by ages from -_MAXIMUM_STRIDE,
+        # at which the sums are zero, up to at least age. The sum over a run of ages with a
+        # given stride is thus the difference of two entries.
+        self._ensure(age)
+        if self._sums is None:
+            size = self._powers.size
+            greatest = _DecayTables._MAXIMUM_STRIDE
+            table = np.zeros((greatest, greatest + size))
+            for stride in range(1, greatest + 1):
+                padded = np.zeros(-(-size // stride) * stride)
+                padded[1:size] = self._powers[1:]
+                table[stride - 1, greatest:] = np.cumsum(padded.reshape(-1, stride),
+                                                         axis=0).ravel()[:size]
+            self._sums = table.ravel()
+        return self._sums, self._sums.size // _DecayTables._MAXIMUM_STRIDE
+
 
 def similarity(function, *attributes):
     """Add a function to compute the similarity of attribute values that are not equal.
@@ -1024,6 +4428,13 @@ def similarity(function, *attributes):
     If ``None`` is passed as the value of *function* the similarity
     function(s) for the specified attributes are cleared.
 
+    A similarity function that is costly to compute can be wrapped with
+    :func:`cached_similarity` to remember the values it has recently computed.
+
+    Similarity functions set with this function are shared by all the agents in the
+    process. A similarity function can instead be set for a single agent with
+    :meth:`Agent.similarity`, which takes precedence over any set here.
+
     In the following examples the height and width are assumed to range from zero to
     ten, and similarity of either is computed linearly, as the difference between
     them normalized by the maximum length of ten. The colors pink and red are considered
@@ -1069,6 +4480,13 @@ If either *x* or *y* is not positive a :exc:`ValueError` is raised.
 0.5
 >>> positive_linear_similarity(10.001, 10.002)
 0.9999000199960006
+
+The function :func:`positive_linear_similarity.vectorized` computes the similarities of
+one value to each of an array, or other sequence, of them at once, returning a NumPy
+array. If any of the values is not positive a :exc:`ValueError` is raised.
+
+>>> positive_linear_similarity.vectorized(1, [1, 2, 4])
+array([1.  , 0.5 , 0.25])
 """
     if x <= 0 or y <= 0:
         raise ValueError(f"the arguments, {x} and {y}, are not both positive")
@@ -1078,6 +4496,14 @@ If either *x* or *y* is not positive a :exc:`ValueError` is raised.
         x, y = y, x
     return 1 - (y - x) / y
 
+def _positive_linear_similarities(x, ys):
+    ys = np.asarray(ys, dtype=float)
+    if x <= 0 or np.any(ys <= 0):
+        raise ValueError(f"the arguments, {x} and {ys}, are not all positive")
+    return 1 - np.abs(ys - x) / np.maximum(ys, x)
+
+positive_linear_similarity.vectorized = _positive_linear_similarities
+
 def positive_quadratic_similarity(x, y):
     """Returns a similarity value of two positive :class:`Real` numbers, scaled quadratically by the larger of them.
 If *x* and *y* are equal the value is one, and otherwise a positive float less than one
@@ -1103,9 +4529,16 @@ If either *x* or *y* is not positive a :exc:`ValueError` is raised.
 0.25
 >>> positive_quadratic_similarity(10.001, 10.002)
 0.9998000499880025
+
+As with :func:`positive_linear_similarity` there is a vectorized version.
+
+>>> positive_quadratic_similarity.vectorized(1, [1, 2, 4])
+array([1.    , 0.25  , 0.0625])
 """
     return positive_linear_similarity(x, y)**2
 
+positive_quadratic_similarity.vectorized = lambda x, ys: _positive_linear_similarities(x, ys)**2
+
 def bounded_linear_similarity(minimum, maximum):
     """Returns a function of two arguments that returns a similarity value reflecting a linear scale between *minimum* and *maximum*.
 The two arguments to the function returned should be :class:`Real` numbers between
@@ -1124,6 +4557,12 @@ When the returned function is called if either of its arguments is not a Real nu
 or greater than *maximum*, a warning is issued, and either *minimum* or *maximum*,
 respectively, is instead used as the argument's value.
 
+The function returned has an attribute ``vectorized``, a function of a Real number
+and an array, or other sequence, of Real numbers, that returns a NumPy array of the
+similarities of the former to each of the latter. Arguments to it less than *minimum* or
+greater than *maximum* are similarly replaced, but only a single warning is issued for
+each call, counting how many were replaced.
+
 >>> f = bounded_linear_similarity(-1, 1)
 >>> f(0, 1)
 0.5
@@ -1137,6 +4576,9 @@ respectively, is instead used as the argument's value.
 2.220446049250313e-16
 >>> f(0, _)
 0.9999999999999999
+>>> f.vectorized(0, [-1, 0, 0.5, 3])
+UserWarning: 1 values outside the range -1 to 1 were replaced by the nearest value in that range in computing similarities
+array([0.5 , 1.  , 0.75, 0.5 ])
 
     """
     if minimum >= maximum:
@@ -1155,6 +4597,14 @@ respectively, is instead used as the argument's value.
             warn(f"{y} is greater than {maximum}, so {maximum} is instead being used in computing similarity")
             y = maximum
         return 1 - abs(x - y) / abs(maximum - minimum)
+    def _similarities(x, ys):
+        values = np.append(np.asarray(ys, dtype=float), x)
+        clamped = np.count_nonzero((values < minimum) | (values > maximum))
+        if clamped:
+            warn(f"{clamped} values outside the range {minimum} to {maximum} were replaced by the nearest value in that range in computing similarities")
+            values = np.clip(values, minimum, maximum)
+        return 1 - np.abs(values[-1] - values[:-1]) / abs(maximum - minimum)
+    _similarity.vectorized = _similarities
     return _similarity
 
 def bounded_quadratic_similarity(minimum, maximum):
@@ -1175,6 +4625,9 @@ When the returned function is called if either of its arguments is not a Real nu
 or greater than *maximum*, a warning is issued, and either *minimum* or *maximum*,
 respectively, is instead used as the argument's value.
 
+As with :func:`bounded_linear_similarity` the function returned has a ``vectorized``
+attribute.
+
 >>> f = bounded_quadratic_similarity(-1, 1)
 >>> f(0, 1)
 0.25
@@ -1191,7 +4644,65 @@ respectively, is instead used as the argument's value.
 
     """
     f = bounded_linear_similarity(minimum, maximum)
-    return lambda x, y: f(x, y)**2
+    def _similarity(x, y):
+        return f(x, y)**2
+    _similarity.vectorized = lambda x, ys: f.vectorized(x, ys)**2
+    return _similarity
+
+def cached_similarity(function, maxsize=1024):
+    """Returns a function of two arguments that computes the same similarity values as *function*, but remembers the most recently computed ones.
+The *function* should be a similarity function as described for :func:`similarity`, and
+the values passed to the returned function must be :class:`Hashable`. Attribute values
+typically recur constantly from one round to the next, so many of the calls of a
+similarity function can be replaced by looking up the value previously computed. At
+most *maxsize* values are remembered, those least recently used being discarded to make
+room for new ones.
+
+The function returned has a ``cache_info()`` method, returning a named tuple of the
+number of calls that were answered from the cache (``hits``), the number that were not
+(``misses``), the *maxsize*, and the number of values currently remembered
+(``currsize``); and a ``cache_clear()`` method that forgets them all and resets those
+counters. As each call of :func:`cached_similarity` creates a fresh cache, calling it
+separately for each attribute provides each with its own cache and counters.
+
+Each agent already remembers the similarity values it has computed, but only for
+itself, starting afresh with each new agent, as in each replicate of a model, and
+forgetting them all whenever a similarity function is set or too many have been
+remembered. A function returned by :func:`cached_similarity` instead shares its values
+among all the agents using it, including the members of a :class:`Cohort` and
+successive replicates, keeps them when similarity functions are set, discards only
+those least recently used, and counts its hits and misses.
+
+If *function* has a ``vectorized`` version, as do those provided by PyIBL, the
+function returned has the same one, so that :attr:`Agent.vectorized` agents still
+compute many similarities at once; those computations do not use the cache.
+
+Raises a :exc:`ValueError` if *function* is not callable, or if *maxsize* is not a
+positive integer.
+
+>>> f = cached_similarity(positive_linear_similarity, 100)
+>>> similarity(f, "height")
+>>> f(1, 2)
+0.5
+>>> f(1, 2)
+0.5
+>>> f(2, 4)
+0.5
+>>> f.cache_info()
+CacheInfo(hits=1, misses=2, maxsize=100, currsize=2)
+
+    """
+    if not callable(function):
+        raise ValueError(f"{function} is not a function")
+    if not (isinstance(maxsize, numbers.Integral) and maxsize > 0):
+        raise ValueError(f"The maxsize, {maxsize}, is not a positive integer")
+    result = functools.lru_cache(maxsize=maxsize)(function)
+    # lru_cache only copies the __dict__ of function, which lacks the vectorized version
+    # of a callable object whose class provides it.
+    vectorized = getattr(function, "vectorized", None)
+    if vectorized is not None:
+        result.vectorized = vectorized
+    return result
 
 
 # Local variables:
@@ -0,0 +1,36 @@
+# Copyright 2014-2021 Carnegie Mellon University
+
+import pytest
+
+from pyibl import Agent, Cohort
+
+pytestmark = pytest.mark.filterwarnings("ignore:Setting noise to 0", "ignore:A noise of 0")
+
+
+def _outcome(member, choice, t):
+    # deterministic, differing between members, and repeating so that instances recur
+    return (member * 3 + "abc".index(choice) * 5 + t % 4) % 7 - 2
+
+
+@pytest.mark.parametrize("optimized_learning", [False, True])
+def test_members_learn_as_agents(optimized_learning):
+    size = 8
+    cohort = Cohort(size, noise=0, default_utility=9, optimized_learning=optimized_learning)
+    agents = [ Agent(noise=0, default_utility=9, optimized_learning=optimized_learning)
+               for m in range(size) ]
+    # distinct initial values, so that there are no ties to be broken at random
+    for outcome, choice in ((5, "a"), (6, "b")):
+        cohort.populate(outcome, choice)
+        for a in agents:
+            a.populate(outcome, choice)
+    for t in range(40):
+        choices = cohort.choose_all("a", "b", "c")
+        assert choices == [ a.choose("a", "b", "c") for a in agents ]
+        outcomes = [ _outcome(m, c, t) for m, c in enumerate(choices) ]
+        cohort.respond_all(outcomes)
+        for a, outcome in zip(agents, outcomes):
+            a.respond(outcome)
+        if t == 20:
+            cohort.reset(True)
+            for a in agents:
+                a.reset(True)
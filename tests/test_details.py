@@ -0,0 +1,54 @@
+# Copyright 2014-2021 Carnegie Mellon University
+
+import random
+
+import pytest
+
+from pyibl import Agent, DetailsWriter
+
+
+def _choices(sample, **kwargs):
+    random.seed(3)
+    a = Agent(default_utility=10, **kwargs)
+    a.details = True
+    if sample:
+        a.sample_details(fraction=0.3)
+    result = []
+    for t in range(200):
+        choice = a.choose("a", "b", "c")
+        result.append(choice)
+        a.respond(random.random() * ("abc".index(choice) + 1))
+    return result, len(a.details)
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+@pytest.mark.parametrize("rng", [5, None])
+def test_sampling_leaves_choices_unchanged(vectorized, rng):
+    choices, count = _choices(False, vectorized=vectorized, rng=rng)
+    sampled_choices, sampled_count = _choices(True, vectorized=vectorized, rng=rng)
+    assert sampled_choices == choices
+    assert 0 < sampled_count < count
+
+
+def test_jsonl_round_trip(tmp_path):
+    path = tmp_path / "details.jsonl"
+    agents = [ Agent(default_utility=10, rng=1) for i in range(2) ]
+    agents[0].details = True
+    with DetailsWriter(path) as writer:
+        agents[1].details = writer
+        for t in range(20):
+            for a in agents:
+                a.choose("a", "b")
+                a.respond(t % 3)
+    records = list(DetailsWriter.read(path))
+    assert len(records) == len(agents[0].details) == 20
+    for record, details in zip(records, agents[0].details):
+        assert [ d["decision"] for d in record ] == [ d["decision"] for d in details ]
+        assert [ d["blended"] for d in record ] == [ d["blended"] for d in details ]
+        for recorded, activations in zip(record, details):
+            for r, a in zip(recorded["activations"], activations["activations"]):
+                # the references are numbers, not strings, though NumPy ones in memory
+                assert r["references"] == [ int(t) for t in a["references"] ]
+                assert all(type(t) is int for t in r["references"])
+                assert r["attributes"] == [ list(x) for x in a["attributes"] ]
+                assert r["activation"] == a["activation"]
@@ -0,0 +1,57 @@
+# Copyright 2014-2021 Carnegie Mellon University
+
+import io
+import pytest
+
+from pyibl import Agent
+
+
+def _instances(agent):
+    f = io.StringIO()
+    agent.instances(file=f, pretty=False)
+    return f.getvalue()
+
+
+def _unnamed(details):
+    # instance names are not saved, new ones being made when an agent is loaded
+    return [ [ dict(d, activations=[ {k: v for k, v in h.items() if k != "name"}
+                                     for h in d["activations"] ])
+               for d in choice ]
+             for choice in details ]
+
+
+def _round_trip(agent):
+    f = io.BytesIO()
+    agent.save(f)
+    f.seek(0)
+    return Agent.load(f)
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_mixed_outcomes_round_trip(vectorized):
+    a = Agent(attributes=["x"], default_utility=10, vectorized=vectorized, rng=1)
+    a.populate(2.5, {"x": 1})
+    a.populate(3, {"x": 1.5})
+    for outcome in (4, 0.5, 4, 7):
+        a.choose({"x": 1}, {"x": 1.5})
+        a.respond(outcome)
+    b = _round_trip(a)
+    assert _instances(b) == _instances(a)
+    assert "1.0" not in _instances(b)
+    a.details = b.details = True
+    for outcome in (1, 2.5, 3):
+        assert b.choose({"x": 1}, {"x": 1.5}) == a.choose({"x": 1}, {"x": 1.5})
+        a.respond(outcome)
+        b.respond(outcome)
+    assert _unnamed(b.details) == _unnamed(a.details)
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_uniform_outcomes_round_trip(vectorized):
+    a = Agent(default_utility=5, vectorized=vectorized, rng=2)
+    for outcome in (1, 2, 3, 4):
+        a.choose("a", "b", "c")
+        a.respond(outcome)
+    b = _round_trip(a)
+    assert _instances(b) == _instances(a)
+    assert b.time == a.time
@@ -0,0 +1,169 @@
+# Copyright 2014-2021 Carnegie Mellon University
+
+import pytest
+
+from pyibl import Agent, cached_similarity, positive_linear_similarity
+
+# with zero noise pyactup sets the temperature to one, warning that it does so
+pytestmark = pytest.mark.filterwarnings("ignore:Setting noise to 0")
+
+
+def _agents(**kwargs):
+    return [ Agent(noise=0, vectorized=v, rng=1, **kwargs) for v in (False, True) ]
+
+
+def _blended(agent, *choices):
+    choice, details = agent.choose2(*choices)
+    return choice, [ d.blended_value for d in details ]
+
+
+def _detailed(agent, *choices):
+    # the choice, with the blended values, error bounds and retrieval probabilities, in
+    # order of utility, of all the choices
+    choice, details = agent.choose2(*choices)
+    probabilities = [ sorted((p.utility, p.retrieval_probability)
+                             for p in d.retrieval_probabilities)
+                      for d in details ]
+    return (choice,
+            [ d.blended_value for d in details ],
+            [ d.error for d in details ],
+            [ u for ps in probabilities for u, p in ps ],
+            [ p for ps in probabilities for u, p in ps ])
+
+
+def _outcome(choice, t):
+    # deterministic, but varied enough that the instances of each choice differ
+    return (t * 7 + sum(map(ord, str(choice)))) % 11 - 3
+
+
+@pytest.mark.parametrize("optimized_learning", [False, True, 3])
+def test_blended_values_agree(optimized_learning):
+    agents = _agents(default_utility=12, decay=0.6, optimized_learning=optimized_learning)
+    for t in range(60):
+        results = [ _blended(a, "a", "b", "c") for a in agents ]
+        assert results[1][0] == results[0][0]
+        assert results[1][1] == pytest.approx(results[0][1])
+        for a in agents:
+            a.respond(_outcome(results[0][0], t))
+
+
+@pytest.mark.parametrize("optimized_learning", [False, True, 3])
+def test_choose_agrees(optimized_learning):
+    # without details, as choose() blends them, all the choices together
+    agents = _agents(default_utility=12, decay=0.6, optimized_learning=optimized_learning)
+    for t in range(200):
+        choices = [ a.choose("a", "b", "c", "d") for a in agents ]
+        assert choices[1] == choices[0]
+        for a in agents:
+            a.respond(_outcome(choices[0], t))
+
+
+@pytest.mark.parametrize("optimized_learning", [False, 3])
+@pytest.mark.parametrize("retrieval_threshold", [None, -1.2])
+@pytest.mark.parametrize("approximate_blending", [None, 2])
+def test_selection_agrees(optimized_learning, retrieval_threshold, approximate_blending):
+    # choose() prunes dominated choices, while choose2() blends every one of them; a
+    # vectorized agent not using optimized_learning computes only the base activations
+    # that bounds show can reach a retrieval threshold or be among the top blended
+    agents = _agents(default_utility=12, decay=0.6, optimized_learning=optimized_learning)
+    for a in agents:
+        a.retrieval_threshold = retrieval_threshold
+        a.approximate_blending = approximate_blending
+    for t in range(120):
+        if t % 3:
+            results = [ _detailed(a, "a", "b", "c") for a in agents ]
+            choice = results[0][0]
+            assert results[1][0] == choice
+            blended, errors, utilities, probabilities = zip(results[1][1:], results[0][1:])
+            assert blended[0] == pytest.approx(blended[1])
+            assert utilities[0] == utilities[1]
+            assert probabilities[0] == pytest.approx(probabilities[1])
+            # an error bound is None unless blending approximately, and the vectorized
+            # agent's may be looser, using bounds on activations it has not computed
+            assert all(v is p is None or v >= p - 1e-12 for v, p in zip(*errors))
+        else:
+            choice = agents[0].choose("a", "b", "c")
+            assert agents[1].choose("a", "b", "c") == choice
+        for a in agents:
+            a.respond(_outcome(choice, t))
+
+
+@pytest.mark.parametrize("optimized_learning", [False, True, 3])
+def test_many_references_agree(optimized_learning):
+    # past the 2048 references after which a vectorized memory merges them into runs;
+    # the outcomes change only every 50 rounds, so that an instance is often chosen
+    # repeatedly, its references making runs longer than one
+    agents = _agents(default_utility=12, decay=0.6, optimized_learning=optimized_learning)
+    for t in range(3000):
+        if t % 250 == 249:
+            results = [ _blended(a, "a", "b") for a in agents ]
+            assert results[1][1] == pytest.approx(results[0][1])
+        else:
+            results = [ (a.choose("a", "b"),) for a in agents ]
+        assert results[1][0] == results[0][0]
+        for a in agents:
+            a.respond((t // 50 + "ab".index(results[0][0]) * 3) % 7)
+
+
+def test_partial_matching_agrees():
+    agents = _agents(attributes=["x", "y"], mismatch_penalty=1.5)
+    options = [ {"x": x, "y": y} for x in (1, 2, 4) for y in ("p", "q") ]
+    for a in agents:
+        a.similarity(positive_linear_similarity, "x")
+        for i, option in enumerate(options):
+            a.populate(8 + i / 10, option)
+    for t in range(40):
+        choices = options[t % 3:t % 3 + 3]
+        results = [ _blended(a, *choices) for a in agents ]
+        assert results[1][0] == results[0][0]
+        assert results[1][1] == pytest.approx(results[0][1])
+        for a in agents:
+            a.respond(_outcome(results[0][0], t))
+
+
+@pytest.mark.parametrize("optimized_learning", [False, 3])
+def test_delayed_feedback_agrees(optimized_learning):
+    agents = _agents(default_utility=10, optimized_learning=optimized_learning)
+    pending = [ [] for a in agents ]
+    for t in range(50):
+        results = [ _blended(a, "a", "b") for a in agents ]
+        assert results[1][0] == results[0][0]
+        assert results[1][1] == pytest.approx(results[0][1])
+        for a, p in zip(agents, pending):
+            p.append(a.respond(None))
+            if len(p) > 3:
+                p.pop(0).update(_outcome(results[0][0], t))
+    for t in range(20):
+        choices = [ a.choose("a", "b") for a in agents ]
+        assert choices[1] == choices[0]
+        for a in agents:
+            a.respond(_outcome(choices[0], t))
+
+
+class _Similarity:
+    # a callable object whose vectorized version is provided by its class
+
+    def __call__(self, x, y):
+        return positive_linear_similarity(x, y)
+
+    def vectorized(self, x, ys):
+        return positive_linear_similarity.vectorized(x, ys)
+
+
+@pytest.mark.parametrize("function", [positive_linear_similarity, _Similarity()])
+def test_cached_similarity_keeps_vectorized(function):
+    cached = cached_similarity(function, 100)
+    assert cached.vectorized(1, [1, 2, 4]) == pytest.approx([1, 0.5, 0.25])
+    agents = _agents(attributes=["x"], mismatch_penalty=1)
+    for a in agents:
+        a.similarity(cached, "x")
+        a.populate(5, *({"x": x} for x in (1, 2, 4)))
+    for t in range(20):
+        results = [ _blended(a, {"x": 1}, {"x": 3}) for a in agents ]
+        assert results[1] == (results[0][0], pytest.approx(results[0][1]))
+        for a in agents:
+            a.respond(_outcome(t, t))
+    # the plain agent's similarities were cached, the vectorized agent's computed at once
+    hits, misses, maxsize, size = cached.cache_info()
+    agents[1].choose({"x": 1}, {"x": 5})
+    assert cached.cache_info() == (hits, misses, maxsize, size) and size > 0